@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiosqlite
+from aiogram import Bot, Dispatcher, types
+
+from bench_common import TOKEN, OfflineApi, build_vault, latency_summary
+from database import AsyncMediaStorage
+from media import send_media
+
+USERS = 50
+HOT_FILES = 50
+
+
+async def legacy_lookup(storage: AsyncMediaStorage, pk: int, user_id: int):
+    """البحث كما كان في send_file_callback قبل الذاكرة المؤقتة: اتصال جديد وتحليل meta_data"""
+    async with aiosqlite.connect(storage.db_path) as db:
+        cursor = await db.execute('SELECT file_id, file_type, meta_data FROM media_files WHERE id = ?', (pk,))
+        file = await cursor.fetchone()
+    if file:
+        file_id, file_type, meta_data = file
+        json.loads(meta_data)
+        return file_id, file_type
+
+
+def make_clicks(count: int, rows: int):
+    """ضغطات متكررة على عدد قليل من الملفات الشائعة، كل منها من صاحب الملف"""
+    rng = random.Random(0)
+    hot = rng.sample(range(1, rows + 1), HOT_FILES)
+    clicks = []
+    for n in range(count):
+        pk = rng.choice(hot)
+        user = {"id": (pk - 1) % USERS + 1, "is_bot": False, "first_name": "user"}
+        clicks.append(types.Update(**{
+            "update_id": n,
+            "callback_query": {
+                "id": str(n), "from": user, "chat_instance": "bench", "data": f"file_{pk}",
+                "message": {"message_id": 1, "date": 0, "chat": {"id": user["id"], "type": "private"}, "text": "📂"},
+            },
+        }))
+    return clicks
+
+
+async def measure(path: str, clicks, mode: str):
+    """زمن معالجة كل ضغطة زر من وصول التحديث حتى الرد على الـ callback"""
+    storage = AsyncMediaStorage(path, file_cache_size=0 if mode == "uncached" else 2048)
+    await storage.initialize_db()
+    bot = OfflineApi(TOKEN)
+    dp = Dispatcher(bot)
+    lookup = (lambda pk, user_id: legacy_lookup(storage, pk, user_id)) if mode == "legacy" else storage.aget_file
+
+    # نفس خطوات send_file_callback: البحث عن الملف ثم إرساله ثم الرد على الزر
+    @dp.callback_query_handler(lambda c: c.data.startswith("file_"))
+    async def send_file_callback(callback_query: types.CallbackQuery):
+        file = await lookup(int(callback_query.data.split("_")[1]), callback_query.from_user.id)
+        await send_media(bot, callback_query.from_user.id, file[1], file[0])
+        await callback_query.answer()
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    if mode == "warm":
+        for update in clicks[:HOT_FILES * 20]:
+            await dp.updates_handler.notify(update)
+    latencies = []
+    for update in clicks:
+        started = time.perf_counter()
+        await dp.updates_handler.notify(update)
+        latencies.append(time.perf_counter() - started)
+    stats = storage.file_cache.stats()
+    await storage.aclose()
+    await (await bot.get_session()).close()
+    return latencies, stats
+
+
+def main(count: int = 20_000, rows: int = 10_000):
+    logging.disable(logging.WARNING)
+    path = os.path.join(tempfile.mkdtemp(), "vault.db")
+    asyncio.run(build_vault(path, rows, users=USERS))
+    clicks = make_clicks(count, rows)
+    for name, mode in (("قبل: اتصال لكل ضغطة + json.loads", "legacy"),
+                       ("بدون ذاكرة مؤقتة", "uncached"),
+                       ("ذاكرة مؤقتة دافئة", "warm")):
+        latencies, stats = asyncio.run(measure(path, clicks, mode))
+        print(f"{name}: {latency_summary(latencies)}" + (f" - {stats}" if mode == "warm" else ""))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
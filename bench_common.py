@@ -0,0 +1,81 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List
+
+from aiogram import Bot
+
+from database import AsyncMediaStorage
+from outbound import ScheduledBot
+
+TOKEN = "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def latency_summary(seconds: List[float]) -> str:
+    """p50 و p99 بالملي ثانية لقائمة أزمنة مقيسة بالثواني"""
+    return f"p50 {percentile(seconds, 0.5) * 1000:.2f} ms / p99 {percentile(seconds, 0.99) * 1000:.2f} ms"
+
+
+class OfflineApi(Bot):
+    """رد ثابت بدل الاتصال بـ Telegram، حتى يُقاس عمل البوت وحده"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method == "answerCallbackQuery":
+            return True
+        return {"message_id": 1, "date": 0, "chat": {"id": data["chat_id"], "type": "private"}, "text": "ok"}
+
+
+class OfflineBot(ScheduledBot, OfflineApi):
+    pass
+
+
+# كلمات أسماء الملفات والتعليقات في القاعدة المولدة، عربية وإنجليزية
+WORDS = ("تقرير", "فاتورة", "محاضرة", "صورة", "عقد", "ملخص", "report", "invoice", "lecture", "photo", "contract", "notes")
+
+
+async def build_vault(path: str, rows: int, users: int = 1, days: int = 730, chunk: int = 50_000):
+    """إنشاء قاعدة بيانات مولدة بـ `rows` ملفًا موزعة على `users` مستخدمًا وعلى آخر `days` يومًا
+
+    المخطط يُنشأ عبر ترحيلات AsyncMediaStorage نفسها، ثم تُدرج الصفوف مباشرة بـ sqlite3
+    على دفعات لأن الإدراج عبر طبقة التخزين بطيء جدًا لملايين الصفوف. القاعدة الموجودة
+    مسبقًا في `path` تُستخدم كما هي.
+    """
+    if os.path.exists(path):
+        return
+    storage = AsyncMediaStorage(path)
+    await storage.initialize_db()
+    await storage.aclose()
+
+    start = datetime.utcnow() - timedelta(days=days)
+    step = days * 86400 / max(rows, 1)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    for first in range(0, rows, chunk):
+        blobs, files = [], []
+        for n in range(first, min(first + chunk, rows)):
+            word = WORDS[n % len(WORDS)]
+            meta_data = {"file_name": f"{word}-{n}.pdf", "mime_type": "application/pdf"}
+            if n % 3 == 0:
+                meta_data["caption"] = f"{WORDS[(n // 3) % len(WORDS)]} {word} {n}"
+            created_at = (start + timedelta(seconds=n * step)).strftime("%Y-%m-%d %H:%M:%S")
+            blobs.append((n + 1, f"unique-{n}", f"file-{n}", "document", 1024, created_at))
+            files.append((n + 1, f"file-{n}", "document", n % users + 1, json.dumps(meta_data), created_at, n + 1))
+        with conn:
+            conn.executemany('''
+                INSERT INTO media_blobs (id, file_unique_id, file_id, file_type, file_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', blobs)
+            conn.executemany('''
+                INSERT INTO media_files (id, file_id, file_type, user_id, meta_data, created_at, blob_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', files)
+    conn.execute("ANALYZE")
+    conn.close()
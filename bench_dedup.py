@@ -0,0 +1,91 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from typing import List
+
+from database import AsyncMediaStorage, SaveRow
+
+SAMPLE_DB = "media.db"
+BATCH = 50
+
+
+def storage_size(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    files = conn.execute("SELECT COUNT(*) FROM media_files").fetchone()[0]
+    has_blobs = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'media_blobs'").fetchone()
+    blobs = conn.execute("SELECT COUNT(*) FROM media_blobs").fetchone()[0] if has_blobs else 0
+    size = conn.execute("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()").fetchone()[0]
+    conn.close()
+    return {"files": files, "blobs": blobs, "bytes": size}
+
+
+def legacy_copy(sample: str) -> str:
+    path = os.path.join(tempfile.mkdtemp(), "vault.db")
+    shutil.copy(sample, path)
+    return path
+
+
+def replay_rows(sample: str, uploads: int) -> List[SaveRow]:
+    """إعادة إرسال ملفات العينة بالتناوب، مع file_unique_id ثابت لكل ملف كما ترسله Telegram"""
+    conn = sqlite3.connect(sample)
+    files = conn.execute("SELECT DISTINCT file_id, file_type, user_id FROM media_files ORDER BY id").fetchall()
+    conn.close()
+    return [(file_id, file_type, user_id, None, f"unique-{files.index((file_id, file_type, user_id))}", None)
+            for file_id, file_type, user_id in (files[n % len(files)] for n in range(uploads))]
+
+
+def replay_legacy(path: str, rows: List[SaveRow]):
+    """الحفظ قبل الترحيل 4: صف جديد لكل رفع دون أي دمج"""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO media_files (file_id, file_type, user_id) VALUES (?, ?, ?)",
+                         [row[:3] for row in rows])
+    conn.execute("VACUUM")
+    conn.close()
+
+
+async def replay_dedup(path: str, rows: List[SaveRow]) -> int:
+    """ضغط القاعدة القديمة ثم إعادة الإرسال عبر asave_files بدفعات كطابور الحفظ"""
+    storage = AsyncMediaStorage(path)
+    await storage.initialize_db()
+    try:
+        await storage.acompact_duplicates()
+        saved = 0
+        for start in range(0, len(rows), BATCH):
+            saved += sum(await storage.asave_files(rows[start:start + BATCH]))
+        async with storage.pool.write() as db:
+            await db.execute("VACUUM")
+        return saved
+    finally:
+        await storage.aclose()
+
+
+def main(uploads: int = 20_000, sample: str = SAMPLE_DB):
+    rows = replay_rows(sample, uploads)
+    distinct = len({row[4] for row in rows})
+    print(f"📦 العينة: {storage_size(sample)['files']} صف، {distinct} ملف مختلف - إعادة إرسال {uploads} مرة")
+
+    path = legacy_copy(sample)
+    replay_legacy(path, rows)
+    before = storage_size(path)
+    print(f"قبل (صف لكل رفع): {before['files']} صف - {before['bytes'] / 1e6:.2f} MB")
+
+    path = legacy_copy(sample)
+    saved = asyncio.run(replay_dedup(path, rows))
+    after = storage_size(path)
+    print(f"بعد (ضغط ثم file_unique_id): {after['files']} صف - {after['blobs']} نسخة - "
+          f"{after['bytes'] / 1e6:.2f} MB - {saved} حفظ جديد")
+
+    # ملفات القاعدة القديمة يجب أن تُطابَق حسب file_id لا أن تُنسخ من جديد
+    if after["blobs"] != distinct or after["files"] != distinct or saved:
+        print(f"❌ تكرار بعد إعادة الإرسال: المتوقع {distinct} صف و {distinct} نسخة دون حفظ جديد")
+        sys.exit(1)
+    print(f"✅ التوفير: {before['files'] - after['files']} صف و "
+          f"{(before['bytes'] - after['bytes']) / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000, sys.argv[2] if len(sys.argv) > 2 else SAMPLE_DB)
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiogram import types
+
+from database import AsyncMediaStorage
+from ingestion import MediaIngestQueue
+from media import MEDIA_KINDS
+
+
+def make_messages(count: int):
+    """صور ومستندات كما تصل عند إعادة توجيه ألبومات أو تفريغ قناة"""
+    messages = []
+    for n in range(count):
+        message = {
+            "message_id": n, "date": 0,
+            "chat": {"id": 1000 + n % 20, "type": "private"},
+            "from": {"id": 1000 + n % 20, "is_bot": False, "first_name": "user"},
+        }
+        if n % 2:
+            message["document"] = {"file_id": f"doc-{n}", "file_unique_id": f"doc-unique-{n}",
+                                   "file_name": f"file-{n}.pdf", "mime_type": "application/pdf", "file_size": 1024}
+        else:
+            message["photo"] = [{"file_id": f"photo-{n}", "file_unique_id": f"photo-unique-{n}",
+                                 "width": 90, "height": 90, "file_size": 2048}]
+        messages.append(types.Message(**message))
+    return messages
+
+
+async def replay(messages, batch_size: int) -> float:
+    """زمن حفظ كل الرسائل معًا عبر طابور الحفظ، كما يفعل handle_media"""
+    storage = AsyncMediaStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    await storage.initialize_db()
+    ingest = MediaIngestQueue(storage, batch_size=batch_size)
+    await ingest.start()
+
+    async def handle(message: types.Message) -> bool:
+        media, meta_data = MEDIA_KINDS[message.content_type].extract(message)
+        return await ingest.submit(file_id=media.file_id, file_type=message.content_type,
+                                   user_id=message.from_user.id, meta_data=meta_data,
+                                   file_unique_id=media.file_unique_id, file_size=media.file_size)
+
+    started = time.perf_counter()
+    saved = await asyncio.gather(*(handle(message) for message in messages))
+    elapsed = time.perf_counter() - started
+    await ingest.close()
+    await storage.aclose()
+    assert all(saved), "كل الملفات جديدة في هذا الاختبار"
+    return elapsed
+
+
+def main(count: int = 5000, batch_sizes=(1, 10, 50, 200)):
+    messages = make_messages(count)
+    for batch_size in batch_sizes:
+        elapsed = asyncio.run(replay(messages, batch_size))
+        print(f"دفعة {batch_size}: {count / elapsed:.0f} ملف/ث ({count} ملف في {elapsed:.2f} s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.middlewares.logging import LoggingMiddleware as ContribLoggingMiddleware
+
+from log_pipeline import setup_logging
+from middlewares import LoggingMiddleware
+
+TOKEN = "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+
+
+def make_updates(count: int):
+    text = "رسالة تجريبية طويلة نسبيًا في مجموعة مزدحمة " * 5
+    return [types.Update(**{
+        "update_id": n,
+        "message": {
+            "message_id": n, "date": 0, "text": text,
+            "chat": {"id": -1000000000000 - n % 20, "type": "supergroup"},
+            "from": {"id": 1000 + n % 500, "is_bot": False, "first_name": "user", "username": f"user{n % 500}"},
+        },
+    }) for n in range(count)]
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+async def measure(name: str, updates, configure) -> float:
+    """زمن المعالج الذي تقضيه حلقة الأحداث في dp.process_update لكل التحديثات"""
+    reset_logging()
+    bot = Bot(TOKEN)
+    dp = Dispatcher(bot)
+    listener = configure(dp)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    started = time.thread_time()
+    wall = time.perf_counter()
+    for update in updates:
+        await dp.process_update(update)
+    spent = time.thread_time() - started
+    wall = time.perf_counter() - wall
+    if listener:
+        # انتظار خيط الكتابة حتى لا ينافس السيناريو التالي على المعالج
+        listener.stop()
+    await (await bot.get_session()).close()
+    return spent, wall
+
+
+def main(count: int = 10000, repeats: int = 5):
+    logger = logging.getLogger("bot")
+    path = os.path.join(tempfile.mkdtemp(), "bench.log")
+
+    def nothing(dp):
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def before(dp):
+        # كما كان bot.py يعمل: كتابة متزامنة إلى الملف من داخل حلقة الأحداث
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+        dp.middleware.setup(ContribLoggingMiddleware(logger))
+
+    def after(level=logging.INFO, sample_rate=1.0):
+        def configure(dp):
+            listener = setup_logging(path=path, console=False)
+            dp.middleware.setup(LoggingMiddleware(logger, level=level, sample_rate=sample_rate))
+            return listener
+        return configure
+
+    updates = make_updates(count)
+    scenarios = [
+        ("بدون تسجيل", nothing),
+        ("قبل: contrib + FileHandler", before),
+        ("بعد: طابور JSON", after()),
+        ("بعد: عينة 10%", after(sample_rate=0.1)),
+        ("بعد: الرسائل على DEBUG", after(level=logging.DEBUG)),
+    ]
+    baseline = None
+    for name, configure in scenarios:
+        # أفضل نتيجة من عدة تشغيلات لتقليل أثر الضجيج
+        spent, wall = min(asyncio.run(measure(name, updates, configure)) for _ in range(repeats))
+        if baseline is None:
+            baseline = spent
+            print(f"{name}: {spent * 1000:.0f} ms لكل {count} تحديث")
+            continue
+        print(f"{name}: {(spent - baseline) * 1000:.0f} ms في حلقة الأحداث للتسجيل "
+              f"(الإجمالي {spent * 1000:.0f} ms، الزمن الفعلي {wall * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
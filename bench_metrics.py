@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from bench_common import TOKEN
+from database import AsyncMediaStorage
+from metrics import REGISTRY, MetricsDispatcher, SlowUpdateProfiler
+from outbound import OutboundScheduler, ScheduledBot
+
+BASELINE = "بدون قياس"
+MEASURED = "القياس مفعل"
+
+
+def serve_api(ports: multiprocessing.Queue):
+    """Bot API محلي يرد على كل طلب برسالة ثابتة"""
+    async def handle(request: web.Request) -> web.Response:
+        data = await request.post()
+        return web.json_response({"ok": True, "result": {
+            "message_id": 1, "date": 0, "chat": {"id": int(data["chat_id"]), "type": "private"}, "text": "ok",
+        }})
+
+    async def serve():
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ports.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def start_api() -> multiprocessing.Process:
+    """تشغيل Bot API المحلي في عملية مستقلة، حتى يشمل القياس كلفة طلب HTTP الحقيقية
+    دون أن يتقاسم الخادم قفل GIL أو وقت المعالج مع حلقة أحداث البوت"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_api, args=(ports,), daemon=True)
+    process.start()
+    process.base = f"http://127.0.0.1:{ports.get(timeout=30)}"
+    return process
+
+
+def make_updates(count: int):
+    return [types.Update(**{
+        "update_id": n,
+        "message": {
+            "message_id": n, "date": 0, "text": "/recent",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 7}],
+            "chat": {"id": 1000 + n % 500, "type": "private"},
+            "from": {"id": 1000 + n % 500, "is_bot": False, "first_name": "user"},
+        },
+    }) for n in range(count)]
+
+
+def make_dispatchers(bot: Bot, storage: AsyncMediaStorage):
+    """نفس المعالج في Dispatcher عادي وفي MetricsDispatcher: الاسم ← (Dispatcher، تفعيل القياس)"""
+    dispatchers = {
+        BASELINE: (Dispatcher(bot), False),
+        # نسخة ثانية مطابقة تمامًا: الفرق بينهما هو حد الضجيج في هذا الجهاز
+        "بدون قياس (تكرار)": (Dispatcher(bot), False),
+        "القياس معطل (METRICS_ENABLED=0)": (MetricsDispatcher(bot, profiler=SlowUpdateProfiler()), False),
+        MEASURED: (MetricsDispatcher(bot, profiler=SlowUpdateProfiler()), True),
+        "القياس + تحليل 1%": (MetricsDispatcher(bot, profiler=SlowUpdateProfiler(sample_rate=0.01)), True),
+    }
+    for dp, _ in dispatchers.values():
+        # معالج نموذجي: استعلام من قاعدة البيانات ثم رد عبر HTTP
+        @dp.message_handler(commands=["recent"])
+        async def recent(message: types.Message):
+            files = await storage.alist_files(message.from_user.id, limit=10)
+            await message.answer(f"{len(files)} files")
+    return dispatchers
+
+
+async def measure(updates, dispatchers) -> Dict[str, List[float]]:
+    """زمن المعالج لكل تحديث في كل Dispatcher، بالثواني
+
+    كل تحديث يمر على كل السيناريوهات بترتيب عشوائي، فتصيب تقلبات الجهاز وحرارة
+    الذاكرة المؤقتة كل السيناريوهات بالتساوي ويمكن مقارنتها تحديثًا بتحديث.
+    """
+    times = {name: [] for name in dispatchers}
+    order = list(dispatchers.items())
+    shuffle = random.Random(0).shuffle
+    for update in updates:
+        shuffle(order)
+        for name, (dp, enabled) in order:
+            REGISTRY.enabled = enabled
+            Dispatcher.set_current(dp)
+            # process_time يشمل خيط aiosqlite، أما Bot API المحلي فخارج العملية
+            started = time.process_time()
+            await dp.updates_handler.notify(update)
+            times[name].append(time.process_time() - started)
+    return times
+
+
+def paired_overhead(baseline: List[float], values: List[float], resamples: int = 1000) -> Tuple[float, float, float]:
+    """وسيط الفرق بين زمني نفس التحديث، مع مجال ثقة 95% بإعادة المعاينة (bootstrap)"""
+    diffs = [value - base for base, value in zip(baseline, values)]
+    choices = random.Random(1).choices
+    medians = sorted(statistics.median(choices(diffs, k=len(diffs))) for _ in range(resamples))
+    return statistics.median(diffs), medians[int(resamples * 0.025)], medians[int(resamples * 0.975)]
+
+
+async def run(count: int, api_base: str) -> bool:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    storage = AsyncMediaStorage(path)
+    await storage.initialize_db()
+    await storage.asave_files([
+        (f"file-{n}", "document", 1000 + n % 500, {"file_name": f"file-{n}.pdf"}, f"unique-{n}", 1024)
+        for n in range(5000)
+    ])
+    bot = ScheduledBot(TOKEN, scheduler=OutboundScheduler(), server=TelegramAPIServer.from_base(api_base))
+    Bot.set_current(bot)
+    times = await measure(make_updates(count), make_dispatchers(bot, storage))
+    await storage.aclose()
+    await (await bot.get_session()).close()
+    REGISTRY.enabled = True
+
+    baseline = statistics.median(times[BASELINE])
+    print(f"{BASELINE}: {baseline * 1e6:.0f} µs لكل تحديث (استعلام + رد عبر HTTP محلي، {count} تحديث)")
+    results = {}
+    for name, values in times.items():
+        if name == BASELINE:
+            continue
+        results[name] = [value / baseline * 100 for value in paired_overhead(times[BASELINE], values)]
+        median, low, high = results[name]
+        print(f"{name}: {median * baseline / 100 * 1e6:+.1f} µs ({median:+.2f}%، مجال الثقة {low:+.2f}% .. {high:+.2f}%)")
+
+    median, _, high = results[MEASURED]
+    if high < 1:
+        print(f"✅ كلفة القياس المقيسة {median:+.2f}% وحدها الأعلى {high:+.2f}% أقل من 1%")
+        return True
+    print(f"❌ كلفة القياس المقيسة {median:+.2f}% وحدها الأعلى {high:+.2f}% لا تثبت أنها أقل من 1%")
+    return False
+
+
+def main(count: int = 5000):
+    logging.disable(logging.WARNING)
+    api = start_api()
+    try:
+        passed = asyncio.run(run(count, api.base))
+    finally:
+        api.terminate()
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_common import build_vault, latency_summary
+from database import AsyncMediaStorage, age_threshold
+
+LIST_SQL = '''
+    SELECT id, file_type, meta_data, created_at
+    FROM media_files {hint}
+    WHERE user_id = ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT 10
+'''
+LATEST_SQL = '''
+    SELECT file_id, file_type
+    FROM media_files {hint}
+    WHERE user_id = ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+'''
+# نفس اختيار الصفوف الذي تحذف به adelete_batch الدفعة التالية
+PURGE_SQL = '''
+    SELECT id FROM media_files {hint}
+    WHERE user_id = ? AND created_at < ?
+    ORDER BY created_at, id
+    LIMIT 500
+'''
+
+
+def scan_latency(path: str, sql: str, params: tuple, repeats: int):
+    """زمن الاستعلام بعد إجبار SQLite على تجاهل الفهارس، كما كان قبل الترحيل 2"""
+    conn = sqlite3.connect(path)
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        conn.execute(sql.format(hint="NOT INDEXED"), params).fetchall()
+        times.append(time.perf_counter() - started)
+    conn.close()
+    return times
+
+
+def query_plan(path: str, sql: str, params: tuple) -> str:
+    conn = sqlite3.connect(path)
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql.format(hint=""), params).fetchall()
+    conn.close()
+    return " | ".join(row[-1] for row in plan)
+
+
+async def indexed_latency(path: str, repeats: int):
+    # بدون الذاكرة المؤقتة حتى يصل كل استدعاء إلى SQLite
+    storage = AsyncMediaStorage(path, file_cache_size=0)
+    await storage.initialize_db()
+    lists, latest = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await storage.alist_files(1, limit=10)
+        lists.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await storage.aget_latest_file(1)
+        latest.append(time.perf_counter() - started)
+    await storage.aclose()
+    return lists, latest
+
+
+def main(rows: int = 1_000_000, path: str = None):
+    path = path or os.path.join(tempfile.mkdtemp(), "vault.db")
+    started = time.perf_counter()
+    asyncio.run(build_vault(path, rows))
+    print(f"📦 {rows} صف في {path} ({time.perf_counter() - started:.0f} s)")
+
+    threshold = age_threshold(365)
+    for name, sql, params in (("القائمة", LIST_SQL, (1,)), ("الأحدث", LATEST_SQL, (1,)),
+                              ("دفعة الحذف", PURGE_SQL, (1, threshold))):
+        print(f"🔎 {name}: {query_plan(path, sql, params)}")
+
+    lists, latest = asyncio.run(indexed_latency(path, 1000))
+    print(f"قبل (بدون فهرس): القائمة {latency_summary(scan_latency(path, LIST_SQL, (1,), 5))}"
+          f" - الأحدث {latency_summary(scan_latency(path, LATEST_SQL, (1,), 5))}")
+    print(f"بعد (AsyncMediaStorage): القائمة {latency_summary(lists)} - الأحدث {latency_summary(latest)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_common import build_vault, percentile
+from database import AsyncMediaStorage
+from retention import RetentionEngine
+
+# الحد الأعلى لتاريخ الحذف: كل ملفات المستخدم 1 في القاعدة المولدة أقدم منه
+THRESHOLD = "9999-12-31"
+INSERT_INTERVAL = 0.005
+
+
+async def single_delete(storage: AsyncMediaStorage, user_id: int, threshold: str) -> int:
+    """الحذف كما كان قبل RetentionEngine: عبارة واحدة ومعاملة واحدة"""
+    async with storage.pool.write() as db:
+        async with db.execute("DELETE FROM media_files WHERE user_id = ? AND created_at < ?",
+                              (user_id, threshold)) as cursor:
+            return cursor.rowcount
+
+
+async def purge_under_load(path: str, purge) -> tuple:
+    """تشغيل الحذف بينما يُحفظ ملف جديد لمستخدم آخر كل 5 ms، وإرجاع مدة الحذف وأزمنة الحفظ"""
+    storage = AsyncMediaStorage(path)
+    await storage.initialize_db()
+    latencies = []
+    done = asyncio.Event()
+
+    async def insert_loop():
+        n = 0
+        while not done.is_set():
+            started = time.perf_counter()
+            await storage.asave_files([(f"live-{n}", "document", 2, {"file_name": f"live-{n}.pdf"}, f"live-{n}", 1024)])
+            latencies.append(time.perf_counter() - started)
+            n += 1
+            await asyncio.sleep(INSERT_INTERVAL)
+
+    inserter = asyncio.create_task(insert_loop())
+    await asyncio.sleep(0.5)
+    started = time.perf_counter()
+    deleted = await purge(storage)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await inserter
+    await storage.aclose()
+    return deleted, elapsed, latencies
+
+
+def report(name: str, deleted: int, elapsed: float, latencies):
+    print(f"{name}: حُذف {deleted} ملف في {elapsed:.1f} s - {len(latencies)} عملية حفظ، "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms، الأقصى {max(latencies) * 1000:.1f} ms")
+
+
+def main(rows: int = 1_000_000, template: str = None, baseline: bool = False):
+    directory = tempfile.mkdtemp()
+    template = template or os.path.join(directory, "template.db")
+    asyncio.run(build_vault(template, rows))
+    scenarios = [("RetentionEngine", lambda storage: RetentionEngine(storage).purge(1, THRESHOLD))]
+    if baseline:
+        scenarios.append(("حذف واحد", lambda storage: single_delete(storage, 1, THRESHOLD)))
+    for name, purge in scenarios:
+        # كل سيناريو يعمل على نسخة جديدة لأن الحذف يفرغ القاعدة
+        path = os.path.join(directory, "purge.db")
+        shutil.copyfile(template, path)
+        report(name, *asyncio.run(purge_under_load(path, purge)))
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    # الاستخدام: bench_retention.py [rows] [template.db] [--baseline]
+    args = [arg for arg in sys.argv[1:] if arg != "--baseline"]
+    main(int(args[0]) if args else 1_000_000, args[1] if len(args) > 1 else None, "--baseline" in sys.argv)
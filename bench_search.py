@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_common import build_vault, latency_summary
+from database import AsyncMediaStorage
+
+# كلمة شائعة (1 من كل 12 ملفًا)، كلمة عربية، واسم ملف محدد
+QUERIES = ("report", "محاضرة", "invoice-4201")
+
+
+def like_latency(path: str, query: str, repeats: int):
+    """البحث كما كان قبل FTS5: LIKE على نص JSON في كل الجدول ثم تحليل كل نتيجة"""
+    conn = sqlite3.connect(path)
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = conn.execute('''
+            SELECT file_id, file_type, meta_data
+            FROM media_files
+            WHERE meta_data LIKE ? OR file_type LIKE ?
+        ''', (f"%{query}%", f"%{query}%")).fetchall()
+        [(file_id, file_type, json.loads(meta_data) if meta_data else {}) for file_id, file_type, meta_data in rows]
+        times.append(time.perf_counter() - started)
+    conn.close()
+    return times, len(rows)
+
+
+async def fts_latency(path: str, query: str, repeats: int):
+    storage = AsyncMediaStorage(path)
+    await storage.initialize_db()
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        results = await storage.asearch_files(query, 1, limit=11)
+        times.append(time.perf_counter() - started)
+    await storage.aclose()
+    return times, len(results)
+
+
+def main(rows: int = 1_000_000, path: str = None):
+    path = path or os.path.join(tempfile.mkdtemp(), "vault.db")
+    asyncio.run(build_vault(path, rows))
+    for query in QUERIES:
+        like, like_rows = like_latency(path, query, 3)
+        fts, fts_rows = asyncio.run(fts_latency(path, query, 200))
+        print(f"🔍 {query}: LIKE {latency_summary(like)} ({like_rows} نتيجة)"
+              f" - FTS5 {latency_summary(fts)} (أول {fts_rows} نتيجة)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import aiosqlite
+
+from bench_common import latency_summary
+from database import AsyncMediaStorage
+
+USERS = 50
+
+
+class PerCallStorage:
+    """طبقة التخزين كما كانت قبل SQLitePool: اتصال aiosqlite جديد لكل عملية"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    async def initialize_db(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS media_files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_id TEXT NOT NULL,
+                    file_type TEXT NOT NULL,
+                    user_id INTEGER,
+                    meta_data TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await db.commit()
+
+    async def asave_file(self, file_id: str, file_type: str, user_id: int, meta_data: dict):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT INTO media_files (file_id, file_type, user_id, meta_data)
+                VALUES (?, ?, ?, ?)
+            ''', (file_id, file_type, user_id, json.dumps(meta_data)))
+            await db.commit()
+
+    async def aget_file(self, pk: int, user_id: int) -> Optional[Tuple[str, str]]:
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT file_id, file_type FROM media_files WHERE id = ? AND user_id = ?", (pk, user_id)
+            ) as cursor:
+                return await cursor.fetchone()
+
+    async def aclose(self):
+        pass
+
+
+async def measure(storage, count: int) -> Tuple[List[float], List[float]]:
+    """زمن كل عملية حفظ ثم كل عملية قراءة لملف عشوائي، بالثواني"""
+    await storage.initialize_db()
+    saves = []
+    for n in range(count):
+        started = time.perf_counter()
+        await storage.asave_file(f"file-{n}", "document", n % USERS, {"file_name": f"file-{n}.pdf"})
+        saves.append(time.perf_counter() - started)
+    lookups = []
+    for pk in random.Random(0).choices(range(1, count + 1), k=count):
+        started = time.perf_counter()
+        row = await storage.aget_file(pk, (pk - 1) % USERS)
+        lookups.append(time.perf_counter() - started)
+        assert row is not None, pk
+    await storage.aclose()
+    return saves, lookups
+
+
+def main(count: int = 500):
+    scenarios = [
+        ("قبل: اتصال لكل عملية", PerCallStorage),
+        # بدون الذاكرة المؤقتة حتى تصل كل قراءة إلى SQLite
+        ("بعد: SQLitePool", lambda path: AsyncMediaStorage(path, file_cache_size=0)),
+    ]
+    for name, factory in scenarios:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        saves, lookups = asyncio.run(measure(factory(path), count))
+        print(f"{name}: الحفظ {latency_summary(saves)} - القراءة {latency_summary(lookups)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
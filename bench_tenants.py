@@ -0,0 +1,71 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench_common import build_vault, latency_summary
+from database import AsyncMediaStorage
+
+# (عدد الملفات، عدد المستخدمين): نفس عدد الملفات لكل مستخدم تقريبًا، ومئة ضعف المستخدمين
+SCENARIOS = ((10_000, 50), (1_000_000, 5_000))
+WORKERS = 32
+
+
+def owner(pk: int, users: int) -> int:
+    """صاحب الملف في القاعدة المولدة، كما توزعه build_vault"""
+    return (pk - 1) % users + 1
+
+
+async def load(path: str, rows: int, users: int, ops: int):
+    """عمليات متزامنة لمستخدمين عشوائيين: قائمة، أحدث ملف، وجلب ملف بالرقم من صاحبه ومن غيره"""
+    # بدون الذاكرة المؤقتة حتى تصل كل عملية إلى SQLite
+    storage = AsyncMediaStorage(path, file_cache_size=0)
+    await storage.initialize_db()
+    latencies = {"list": [], "latest": [], "get": []}
+    leaks = []
+    rng = random.Random(0)
+
+    async def worker(count: int):
+        for _ in range(count):
+            user_id = rng.randint(1, users)
+            # نصف عمليات الجلب لملف يملكه المستخدم والنصف الآخر لملف عشوائي غالبًا لغيره
+            if rng.random() < 0.5:
+                pk = user_id + users * rng.randrange(rows // users)
+            else:
+                pk = rng.randint(1, rows)
+            for name, call in (("list", storage.alist_files(user_id, limit=11)),
+                               ("latest", storage.aget_latest_file(user_id)),
+                               ("get", storage.aget_file(pk, user_id))):
+                started = time.perf_counter()
+                result = await call
+                latencies[name].append(time.perf_counter() - started)
+            if (result is not None) != (owner(pk, users) == user_id):
+                leaks.append((pk, user_id))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(ops // WORKERS) for _ in range(WORKERS)))
+    elapsed = time.perf_counter() - started
+    await storage.aclose()
+    return latencies, 3 * (ops // WORKERS) * WORKERS / elapsed, leaks
+
+
+def main(ops: int = 5000, directory: str = None) -> int:
+    directory = directory or tempfile.mkdtemp()
+    failed = 0
+    for rows, users in SCENARIOS:
+        path = os.path.join(directory, f"tenants-{rows}-{users}.db")
+        asyncio.run(build_vault(path, rows, users=users))
+        latencies, throughput, leaks = asyncio.run(load(path, rows, users, ops))
+        print(f"👥 {users} مستخدم / {rows} ملف: القائمة {latency_summary(latencies['list'])}"
+              f" - الأحدث {latency_summary(latencies['latest'])} - الجلب {latency_summary(latencies['get'])}"
+              f" - {throughput:.0f} عملية/ث")
+        if leaks:
+            failed = 1
+            print(f"❌ {len(leaks)} ملف أُعيد لغير صاحبه أو رُفض لصاحبه، مثل {leaks[0]}")
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, sys.argv[2] if len(sys.argv) > 2 else None))
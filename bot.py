@@ -2,12 +2,22 @@ import os
 import logging
 import sys
 import asyncio
-import aiosqlite
 import json
-from aiogram import Bot, Dispatcher, types
+from typing import List, NamedTuple, Optional, Set, Tuple
+from aiogram import Dispatcher, types
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.contrib.middlewares.logging import LoggingMiddleware
+from aiogram.utils.exceptions import MessageNotModified
 from dotenv import load_dotenv
+from cache import LRUCache
+from database import AsyncMediaStorage, DatabaseError, age_threshold
+from ingestion import MediaIngestQueue
+from log_pipeline import setup_logging
+from media import MEDIA_CONTENT_TYPES, MEDIA_KINDS, send_media, send_media_bulk
+from metrics import REGISTRY, MetricsDispatcher, SlowUpdateProfiler, start_metrics_server
+from middlewares import LoggingMiddleware
+from outbound import DELIVERY, OutboundScheduler, ScheduledBot, priority
+from retention import RetentionEngine
+from webhook import WebhookServer
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -16,153 +26,373 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN or len(BOT_TOKEN) < 20:
     raise ValueError("🚨 خطأ: لم يتم العثور على BOT_TOKEN صالح في ملف .env")
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(bot)
+# polling أو webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "128"))
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT") or os.getenv("PORT") or "8080")
+DB_PATH = os.getenv("DB_PATH", "media.db")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+# مستوى ونسبة تسجيل الرسائل الواردة، مثلًا DEBUG لإخفائها أو 0.1 لتسجيل عُشرها
+LOG_MESSAGES_LEVEL = os.getenv("LOG_MESSAGES_LEVEL", "INFO").upper()
+LOG_MESSAGES_SAMPLE_RATE = float(os.getenv("LOG_MESSAGES_SAMPLE_RATE", "1"))
+# METRICS_ENABLED=0 يوقف كل القياسات، لمقارنة الأداء مع وبدون القياس
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# خادم المقاييس المحلي، و METRICS_PORT=0 لإيقافه
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100") or "0")
+# معرّفات المستخدمين المسموح لهم باستخدام /stats، مفصولة بفواصل
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+# نسبة التحديثات التي يُفصّل زمنها لرصد أبطئها، مثلًا 0.01 لتحديث من كل مئة
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"🚨 خطأ: قيمة BOT_MODE غير معروفة: {BOT_MODE}")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("🚨 خطأ: وضع webhook يتطلب WEBHOOK_URL في ملف .env")
+# بدون السر يستطيع أي شخص يصل إلى المنفذ إرسال تحديثات مزورة باسم أي مستخدم
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("🚨 خطأ: وضع webhook يتطلب WEBHOOK_SECRET في ملف .env")
+# getLevelName تُرجع نصًا مثل "Level X" للمستوى غير المعروف بدل رفع خطأ
+for name, level in (("LOG_LEVEL", LOG_LEVEL), ("LOG_MESSAGES_LEVEL", LOG_MESSAGES_LEVEL)):
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"🚨 خطأ: قيمة {name} غير معروفة: {level}")
+
+REGISTRY.enabled = METRICS_ENABLED
+profiler = SlowUpdateProfiler(sample_rate=PROFILE_SAMPLE_RATE, keep=PROFILE_KEEP)
+outbound = OutboundScheduler()
+bot = ScheduledBot(token=BOT_TOKEN, scheduler=outbound)
+dp = MetricsDispatcher(bot, profiler=profiler)
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
-dp.middleware.setup(LoggingMiddleware(logger))
+setup_logging(level=logging.getLevelName(LOG_LEVEL), path=LOG_FILE or None, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS)
+dp.middleware.setup(LoggingMiddleware(
+    logger, level=logging.getLevelName(LOG_MESSAGES_LEVEL), sample_rate=LOG_MESSAGES_SAMPLE_RATE
+))
 
 
-class AsyncMediaStorage:
-    def __init__(self, db_path="media.db"):
-        self.db_path = db_path
+storage = AsyncMediaStorage(DB_PATH)
+ingest = MediaIngestQueue(storage)
+retention = RetentionEngine(
+    storage, on_purge=lambda user_id, threshold, deleted: invalidate_pages_before(threshold, user_id)
+)
 
-    async def initialize_db(self):
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    CREATE TABLE IF NOT EXISTS media_files (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        file_id TEXT NOT NULL,
-                        file_type TEXT NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        meta_data TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                await db.commit()
-        except Exception as e:
-            logger.error(f"🚨 خطأ أثناء تهيئة قاعدة البيانات: {e}")
-
-    async def asave_file(self, file_id, file_type, user_id, meta_data):
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    INSERT INTO media_files (file_id, file_type, user_id, meta_data) 
-                    VALUES (?, ?, ?, ?)
-                ''', (file_id, file_type, user_id, json.dumps(meta_data)))
-                await db.commit()
-        except Exception as e:
-            logger.error(f"🚨 خطأ أثناء حفظ الملف: {e}")
-
-    async def alist_files(self, limit=10):
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute('''
-                    SELECT id, file_type, meta_data 
-                    FROM media_files 
-                    ORDER BY created_at DESC 
-                    LIMIT ?
-                ''', (limit,))
-                return await cursor.fetchall()
-        except Exception as e:
-            logger.error(f"🚨 خطأ أثناء جلب قائمة الملفات: {e}")
-            return []
-
-    async def adelete_old_files(self, days):
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    DELETE FROM media_files 
-                    WHERE created_at < datetime('now', ? || ' days')
-                ''', (-days,))
-                await db.commit()
-        except Exception as e:
-            logger.error(f"🚨 خطأ أثناء حذف الملفات القديمة: {e}")
+FILES_SAVED = REGISTRY.counter("files_saved", "Media files received, by ingest result", ("result",))
+FILE_LOOKUPS = REGISTRY.counter("file_lookups", "Stored files sent back to users, by command", ("source",))
+UPDATE_ERRORS = REGISTRY.counter("bot_update_errors", "Unhandled exceptions while processing updates", ("exception",))
 
 
-storage = AsyncMediaStorage()
+@dp.errors_handler()
+async def count_update_errors(update: types.Update, exception: Exception):
+    # لا يُرجع شيئًا حتى يُعاد رفع الاستثناء ويُسجل كما كان
+    UPDATE_ERRORS.labels(type(exception).__name__).inc()
 
 
-@dp.message_handler(content_types=[
-    types.ContentType.PHOTO, types.ContentType.VIDEO, types.ContentType.DOCUMENT,
-    types.ContentType.AUDIO, types.ContentType.ANIMATION
-])
+@dp.message_handler(content_types=MEDIA_CONTENT_TYPES)
 async def handle_media(message: Message):
     content_type = message.content_type
-    file_id = None
-    file_meta = {}
-
-    if content_type == types.ContentType.DOCUMENT:
-        file_id = message.document.file_id
-        file_meta = {"file_name": message.document.file_name, "mime_type": message.document.mime_type}
-    elif content_type == types.ContentType.PHOTO:
-        file_id = message.photo[-1].file_id
-        file_meta = {"mime_type": "image/jpeg"}
-    elif content_type == types.ContentType.VIDEO:
-        file_id = message.video.file_id
-        file_meta = {"mime_type": message.video.mime_type}
-    elif content_type == types.ContentType.AUDIO:
-        file_id = message.audio.file_id
-        file_meta = {"mime_type": message.audio.mime_type}
-    elif content_type == types.ContentType.ANIMATION:
-        file_id = message.animation.file_id
-        file_meta = {"mime_type": "image/gif"}
-
-    if file_id:
-        await storage.asave_file(file_id=file_id, file_type=content_type, user_id=message.from_user.id, meta_data=file_meta)
-        await message.reply("✅ **تم حفظ الملف بنجاح!**")
-
-async def get_files_keyboard():
-    files = await storage.alist_files(limit=10)
-
-    keyboard = InlineKeyboardMarkup(row_width=1)
+    media, file_meta = MEDIA_KINDS[content_type].extract(message)
+
+    if message.caption:
+        file_meta["caption"] = message.caption
+
+    try:
+        is_new = await ingest.submit(file_id=media.file_id, file_type=content_type, user_id=message.from_user.id,
+                                     meta_data=file_meta, file_unique_id=media.file_unique_id,
+                                     file_size=media.file_size)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء حفظ الملف: {e}")
+        await message.reply("❌ حدث خطأ أثناء حفظ الملف!")
+        return
+    FILES_SAVED.labels("new" if is_new else "duplicate").inc()
+    if is_new:
+        invalidate_pages_on_insert(message.from_user.id)
+    # التأكيدات المتتالية (مثل ألبوم كامل) تُدمج في رد واحد
+    outbound.acknowledge(message, is_new)
+
+PAGE_SIZE = 10
+MAX_SELECTION = 100
+page_cache = LRUCache(maxsize=512)
+# حالة كل رسالة قائمة: الصفحة المعروضة والملفات المحددة (None خارج وضع التحديد)
+list_views = LRUCache(maxsize=1024, ttl=3600)
+
+
+class FilesPage(NamedTuple):
+    files: List[Tuple[int, str]]
+    newer: Optional[str]
+    older: Optional[str]
+    # لا توجد ملفات أحدث من هذه الصفحة، فأي ملف جديد يغيّرها
+    at_top: bool
+    # أقدم created_at تعتمد عليه الصفحة: آخر صف فيها أو الصف الذي يليها
+    floor: Optional[str]
+
+
+def invalidate_pages_on_insert(user_id: int):
+    page_cache.discard_where(lambda key, page: key[0] == user_id and page.at_top)
+
+
+def invalidate_pages_before(threshold: str, user_id: int):
+    page_cache.discard_where(
+        lambda key, page: key[0] == user_id and page.floor is not None and page.floor < threshold
+    )
+
+
+async def get_files_page(user_id: int, direction: Optional[str] = None, cursor: Optional[Tuple[str, int]] = None) -> FilesPage:
+    key = (user_id, direction, cursor)
+    page = page_cache.get(key)
+    if page is not None:
+        return page
+
+    generation = page_cache.generation
+    if direction == "newer":
+        files = await storage.alist_files(user_id, limit=PAGE_SIZE + 1, after=cursor)
+        has_newer = len(files) > PAGE_SIZE
+        files = files[-PAGE_SIZE:]
+        has_older = True
+        floor = cursor[0]
+    else:
+        files = await storage.alist_files(user_id, limit=PAGE_SIZE + 1, before=cursor)
+        has_newer = cursor is not None
+        has_older = len(files) > PAGE_SIZE
+        floor = files[-1][3] if files else (cursor[0] if cursor else None)
+        files = files[:PAGE_SIZE]
+
+    entries = []
     for file in files:
-        file_id, file_type, meta_data = file
+        file_id, file_type, meta_data, created_at = file
         try:
             meta_data = json.loads(meta_data)
-            file_name = meta_data.get("file_name", "ملف غير معروف")
-        except json.JSONDecodeError:
+            file_name = meta_data.get("file_name") or "ملف غير معروف"
+        except (json.JSONDecodeError, TypeError):
             file_name = "ملف غير معروف"
+        entries.append((file_id, file_name))
+
+    newer = older = None
+    if files and has_newer:
+        newest_id, _, _, newest_created_at = files[0]
+        newer = f"page_newer_{newest_id}_{newest_created_at}"
+    if files and has_older:
+        oldest_id, _, _, oldest_created_at = files[-1]
+        older = f"page_older_{oldest_id}_{oldest_created_at}"
+
+    page = FilesPage(files=entries, newer=newer, older=older, at_top=not has_newer, floor=floor)
+    page_cache.set(key, page, generation=generation)
+    return page
+
+
+def render_files_page(page: FilesPage, selected: Optional[Set[int]] = None) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for file_id, file_name in page.files:
+        if selected is None:
+            button = InlineKeyboardButton(text=file_name, callback_data=f"file_{file_id}")
+        else:
+            mark = "✅" if file_id in selected else "⬜"
+            button = InlineKeyboardButton(text=f"{mark} {file_name}", callback_data=f"pick_{file_id}")
+        keyboard.row(button)
+
+    navigation = []
+    if page.newer:
+        navigation.append(InlineKeyboardButton(text="⬅️ الأحدث", callback_data=page.newer))
+    if page.older:
+        navigation.append(InlineKeyboardButton(text="الأقدم ➡️", callback_data=page.older))
+    if navigation:
+        keyboard.row(*navigation)
+
+    if selected is None:
+        keyboard.row(InlineKeyboardButton(text="☑️ تحديد عدة ملفات", callback_data="select_on"))
+    else:
+        keyboard.row(
+            InlineKeyboardButton(text=f"📤 إرسال المحدد ({len(selected)})", callback_data="select_send"),
+            InlineKeyboardButton(text="✖️ إلغاء", callback_data="select_off"),
+        )
+    return keyboard
 
-        button = InlineKeyboardButton(text=file_name, callback_data=f"file_{file_id}")
-        keyboard.add(button)
 
-    return keyboard
+async def refresh_list_view(callback_query: types.CallbackQuery, view: dict):
+    """إعادة رسم رسالة القائمة حسب صفحتها الحالية وحالة التحديد"""
+    page = await get_files_page(callback_query.from_user.id, *view["page"])
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=render_files_page(page, view["selected"]))
+    except MessageNotModified:
+        pass
 
 
 @dp.message_handler(commands=['list_files'])
 async def list_files(message: Message):
-    keyboard = await get_files_keyboard()
-    if not keyboard.inline_keyboard:
+    try:
+        page = await get_files_page(message.from_user.id)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء جلب قائمة الملفات: {e}")
+        await message.reply("❌ حدث خطأ أثناء جلب قائمة الملفات!")
+        return
+    if not page.files:
         await message.reply("📭 **لا يوجد ملفات مخزنة بعد!**")
         return
-    await message.reply("📂 **الملفات المتاحة:**", reply_markup=keyboard)
+    reply = await message.reply("📂 **الملفات المتاحة:**", reply_markup=render_files_page(page))
+    list_views.set((reply.chat.id, reply.message_id), {"page": (None, None), "selected": None})
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("page_"))
+async def files_page_callback(callback_query: types.CallbackQuery):
+    _, direction, pk, created_at = callback_query.data.split("_", 3)
+    cursor = (created_at, int(pk))
+    message = callback_query.message
+    view = list_views.get((message.chat.id, message.message_id)) or {"selected": None}
+    try:
+        page = await get_files_page(callback_query.from_user.id, direction, cursor)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء جلب قائمة الملفات: {e}")
+        await callback_query.answer("❌ حدث خطأ أثناء جلب قائمة الملفات!")
+        return
+    if not page.files:
+        await callback_query.answer("📭 لا توجد ملفات أخرى!")
+        return
+    view["page"] = (direction, cursor)
+    list_views.set((message.chat.id, message.message_id), view)
+    try:
+        await message.edit_reply_markup(reply_markup=render_files_page(page, view["selected"]))
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("select_") or c.data.startswith("pick_"))
+async def select_files_callback(callback_query: types.CallbackQuery):
+    message = callback_query.message
+    view = list_views.get((message.chat.id, message.message_id))
+    if view is None:
+        await callback_query.answer("⌛ انتهت صلاحية هذه القائمة، استخدم /list_files من جديد.")
+        return
+
+    action = callback_query.data
+    if action == "select_send":
+        await send_selected_files(callback_query, view)
+        return
+    if action == "select_on":
+        view["selected"] = set()
+    elif action == "select_off":
+        view["selected"] = None
+    elif view["selected"] is not None:
+        file_id = int(action.split("_")[1])
+        if file_id in view["selected"]:
+            view["selected"].discard(file_id)
+        elif len(view["selected"]) >= MAX_SELECTION:
+            await callback_query.answer(f"⚠️ الحد الأقصى {MAX_SELECTION} ملف!")
+            return
+        else:
+            view["selected"].add(file_id)
+
+    try:
+        await refresh_list_view(callback_query, view)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء جلب قائمة الملفات: {e}")
+        await callback_query.answer("❌ حدث خطأ أثناء جلب قائمة الملفات!")
+        return
+    await callback_query.answer()
+
+
+async def send_selected_files(callback_query: types.CallbackQuery, view: dict):
+    selected = view["selected"]
+    if not selected:
+        await callback_query.answer("⚠️ لم يتم تحديد أي ملف!")
+        return
+    user_id = callback_query.from_user.id
+    try:
+        files = [await storage.aget_file(file_id, user_id) for file_id in sorted(selected)]
+        FILE_LOOKUPS.labels("selection").inc(len(files))
+        with priority(DELIVERY):
+            await send_media_bulk(bot, user_id, [file for file in files if file])
+    except Exception as e:
+        logger.error(f"🚨 خطأ أثناء إرسال الملفات المحددة: {e}")
+        # الرد على الزر نفسه لأن الإرسال إلى المحادثة قد يكون هو ما فشل
+        await callback_query.answer("❌ حدث خطأ أثناء استرجاع الملفات!")
+        return
+    view["selected"] = None
+    try:
+        await refresh_list_view(callback_query, view)
+    except Exception as e:
+        logger.error(f"🚨 خطأ أثناء تحديث قائمة الملفات: {e}")
+    await callback_query.answer()
+
+SEARCH_PAGE_SIZE = 10
+
+
+async def get_search_keyboard(query: str, user_id: int, offset: int = 0):
+    results = await storage.asearch_files(query, user_id, limit=SEARCH_PAGE_SIZE + 1, offset=offset)
+
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for file_id, file_type, file_name in results[:SEARCH_PAGE_SIZE]:
+        button = InlineKeyboardButton(text=file_name or f"📎 {file_type}", callback_data=f"file_{file_id}")
+        keyboard.row(button)
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(text="⬅️ السابق", callback_data=f"search_{max(offset - SEARCH_PAGE_SIZE, 0)}"))
+    if len(results) > SEARCH_PAGE_SIZE:
+        navigation.append(InlineKeyboardButton(text="التالي ➡️", callback_data=f"search_{offset + SEARCH_PAGE_SIZE}"))
+    if navigation:
+        keyboard.row(*navigation)
+
+    return keyboard
+
+
+@dp.message_handler(commands=['search'])
+async def search_files(message: Message):
+    query = message.get_args().strip()
+    if not query:
+        await message.reply("⚠️ **يرجى إدخال كلمة للبحث!**\n📌 مثال: `/search تقرير`")
+        return
+
+    try:
+        keyboard = await get_search_keyboard(query, message.from_user.id)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء البحث عن الملفات: {e}")
+        await message.reply("❌ حدث خطأ أثناء البحث!")
+        return
+
+    if not keyboard.inline_keyboard:
+        await message.reply("🔍 **لا توجد نتائج مطابقة!**")
+        return
+    await message.reply("🔍 **نتائج البحث:**", reply_markup=keyboard)
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("search_"))
+async def search_page_callback(callback_query: types.CallbackQuery):
+    # نص البحث يُقرأ من رسالة الأمر الأصلية لأن callback_data محدودة بـ 64 بايت
+    command = callback_query.message.reply_to_message
+    query = command.get_args().strip() if command else ""
+    offset = int(callback_query.data.split("_")[1])
+    try:
+        keyboard = await get_search_keyboard(query, callback_query.from_user.id, offset)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء البحث عن الملفات: {e}")
+        await callback_query.answer("❌ حدث خطأ أثناء البحث!")
+        return
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith("file_"))
 async def send_file_callback(callback_query: types.CallbackQuery):
     file_id = callback_query.data.split("_")[1]  
     try:
-        async with aiosqlite.connect(storage.db_path) as db:
-            cursor = await db.execute('SELECT file_id, file_type, meta_data FROM media_files WHERE id = ?', (file_id,))
-            file = await cursor.fetchone()
+        file = await storage.aget_file(int(file_id), callback_query.from_user.id)
+        FILE_LOOKUPS.labels("button").inc()
 
         if file:
-            file_id, file_type, meta_data = file
-            meta_data = json.loads(meta_data)
+            file_id, file_type = file
 
-            if file_type == types.ContentType.PHOTO:
-                await bot.send_photo(callback_query.from_user.id, file_id)
-            elif file_type == types.ContentType.VIDEO:
-                await bot.send_video(callback_query.from_user.id, file_id)
-            elif file_type == types.ContentType.DOCUMENT:
-                await bot.send_document(callback_query.from_user.id, file_id)
-            elif file_type == types.ContentType.AUDIO:
-                await bot.send_audio(callback_query.from_user.id, file_id)
-            elif file_type == types.ContentType.ANIMATION:
-                await bot.send_animation(callback_query.from_user.id, file_id)
-            else:
+            with priority(DELIVERY):
+                sent = await send_media(bot, callback_query.from_user.id, file_type, file_id)
+            if not sent:
                 await callback_query.message.answer("⚠️ نوع الملف غير مدعوم!")
 
             await callback_query.answer() 
@@ -180,34 +410,83 @@ async def clear_old_files(message: Message):
         return
 
     days = int(args)
-    await storage.adelete_old_files(days)
-    await message.reply(f"🗑️ **تم حذف الملفات الأقدم من {days} يومًا!**")
+    await run_purge(message, age_threshold(days), f"🗑️ **تم حذف الملفات الأقدم من {days} يومًا!**")
+
+
+PURGE_PROGRESS_INTERVAL = 2.0
+
+
+async def run_purge(message: Message, threshold: str, done_text: str):
+    """تنفيذ الحذف على دفعات مع تحديث رسالة الحالة في المحادثة"""
+    status = await message.reply("⏳ جارٍ حذف الملفات...")
+    loop = asyncio.get_running_loop()
+    last_update = loop.time()
+
+    async def report(deleted: int):
+        nonlocal last_update
+        if loop.time() - last_update < PURGE_PROGRESS_INTERVAL:
+            return
+        last_update = loop.time()
+        try:
+            await status.edit_text(f"⏳ جارٍ حذف الملفات... ({deleted} حتى الآن)")
+        except MessageNotModified:
+            pass
+
+    try:
+        deleted = await retention.purge(message.from_user.id, threshold, progress=report)
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء حذف الملفات القديمة: {e}")
+        await status.edit_text("❌ حدث خطأ أثناء حذف الملفات!")
+        return
+    await status.edit_text(f"{done_text}\n📊 عدد الملفات المحذوفة: {deleted}")
+
+
+@dp.message_handler(commands=['retention'])
+async def set_retention(message: Message):
+    args = message.get_args().strip()
+    user_id = message.from_user.id
+    try:
+        if not args:
+            ttl_days = await storage.aget_retention_policy(user_id)
+            if ttl_days is None:
+                await message.reply("♾️ **لا يوجد حذف تلقائي لملفاتك.**\n📌 مثال: `/retention 30`")
+            else:
+                await message.reply(f"⏱️ **يتم حذف ملفاتك تلقائيًا بعد {ttl_days} يومًا.**")
+            return
+        if args == "off":
+            await storage.aclear_retention_policy(user_id)
+            await message.reply("♾️ **تم إيقاف الحذف التلقائي لملفاتك.**")
+            return
+        if not args.isdigit() or int(args) < 1:
+            await message.reply("⚠️ **يرجى إدخال عدد الأيام أو off!**\n📌 مثال: `/retention 30`")
+            return
+        await storage.aset_retention_policy(user_id, int(args))
+    except DatabaseError as e:
+        logger.error(f"🚨 خطأ أثناء تحديث سياسة الاحتفاظ: {e}")
+        await message.reply("❌ حدث خطأ أثناء تحديث سياسة الاحتفاظ!")
+        return
+    await message.reply(f"⏱️ **سيتم حذف ملفاتك تلقائيًا بعد {args} يومًا.**")
 
 @dp.message_handler(commands=['play'])
 async def play_last_file(message: Message):
+    args = message.get_args().strip()
+    if args and (not args.isdigit() or int(args) < 1):
+        await message.reply("⚠️ **يرجى إدخال عدد الملفات!**\n📌 مثال: `/play 5`")
+        return
+
     try:
-        async with aiosqlite.connect(storage.db_path) as db:
-            cursor = await db.execute('''
-                SELECT file_id, file_type FROM media_files 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            ''')
-            last_file = await cursor.fetchone()
-
-        if last_file:
-            file_id, file_type = last_file
-
-            if file_type == types.ContentType.PHOTO:
-                await bot.send_photo(message.chat.id, file_id)
-            elif file_type == types.ContentType.VIDEO:
-                await bot.send_video(message.chat.id, file_id)
-            elif file_type == types.ContentType.DOCUMENT:
-                await bot.send_document(message.chat.id, file_id)
-            elif file_type == types.ContentType.AUDIO:
-                await bot.send_audio(message.chat.id, file_id)
-            elif file_type == types.ContentType.ANIMATION:
-                await bot.send_animation(message.chat.id, file_id)
-            else:
+        if not args or int(args) == 1:
+            last_file = await storage.aget_latest_file(message.from_user.id)
+            files = [last_file] if last_file else []
+        else:
+            files = await storage.alist_latest_files(message.from_user.id, min(int(args), MAX_SELECTION))
+        FILE_LOOKUPS.labels("play").inc(len(files))
+
+        if files:
+            # الإرسال من الأقدم إلى الأحدث حتى يظهر آخر ملف في أسفل المحادثة
+            with priority(DELIVERY):
+                skipped = await send_media_bulk(bot, message.chat.id, files[::-1])
+            if skipped:
                 await message.reply("⚠️ نوع الملف غير مدعوم!")
 
         else:
@@ -229,18 +508,7 @@ async def delete_by_date(message: Message):
         await message.reply("⚠️ **يرجى إدخال التاريخ بالتنسيق الصحيح (YYYY-MM-DD)**\n📌 مثال: `/delete_by_date 2024-03-01`")
         return
 
-    try:
-        async with aiosqlite.connect(storage.db_path) as db:
-            await db.execute('''
-                DELETE FROM media_files WHERE DATE(created_at) < ?
-            ''', (delete_date,))
-            await db.commit()
-
-        await message.reply(f"🗑️ **تم حذف جميع الملفات قبل {delete_date}!**")
-
-    except Exception as e:
-        logger.error(f"🚨 خطأ أثناء حذف الملفات بتاريخ معين: {e}")
-        await message.reply("❌ حدث خطأ أثناء حذف الملفات!")
+    await run_purge(message, delete_date.isoformat(), f"🗑️ **تم حذف جميع الملفات قبل {delete_date}!**")
 
 
 @dp.message_handler(commands=['help'])
@@ -248,19 +516,147 @@ async def send_help(message: Message):
     help_text = """
     **🤖 قائمة الأوامر المتاحة:**
     
-    📥 `/list_files` - عرض قائمة الملفات المخزنة.
-    ▶️ `/play` - عرض آخر ملف تم رفعه.
-    🗑️ `/clear_old <عدد الأيام>` - حذف الملفات الأقدم من عدد الأيام المحدد.
-    🗓️ `/delete_by_date <YYYY-MM-DD>` - حذف الملفات قبل تاريخ معين.
+    📥 `/list_files` - عرض قائمة ملفاتك المخزنة.
+    ▶️ `/play [عدد]` - عرض آخر ملف رفعته، أو آخر عدة ملفات مجمعة في ألبومات.
+    🔍 `/search <كلمة>` - البحث في أسماء ملفاتك وأنواعها والتعليقات.
+    🗑️ `/clear_old <عدد الأيام>` - حذف ملفاتك الأقدم من عدد الأيام المحدد.
+    🗓️ `/delete_by_date <YYYY-MM-DD>` - حذف ملفاتك قبل تاريخ معين.
+    ⏱️ `/retention <عدد الأيام|off>` - حذف ملفاتك تلقائيًا بعد مدة محددة.
+    📈 `/stats` - إحصائيات الأداء (للمشرفين فقط).
     ℹ️ `/help` - عرض هذه القائمة للمساعدة.
     
     يمكنك إرسال أي ملف (📸 صورة، 🎥 فيديو، 📄 مستند...) وسيتم تخزينه تلقائيًا.
     """
     await message.reply(help_text, parse_mode="Markdown")
 
-async def main():
+def cache_stats() -> dict:
+    return {"file": storage.file_cache.stats(), "page": page_cache.stats(), "list_view": list_views.stats()}
+
+
+def _register_collectors():
+    """تصدير عدادات الذاكرة المؤقتة والمجدول الموجودة أصلًا دون عدّها مرة ثانية"""
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        REGISTRY.collector(f"cache_{field}", f"LRU cache {field}", kind, ("cache",),
+                           lambda field=field: {(name,): stats[field] for name, stats in cache_stats().items()})
+    for field, kind in (("sent", "counter"), ("retries", "counter"), ("coalesced", "counter"), ("waiting", "gauge")):
+        REGISTRY.collector(f"outbound_{field}", f"Outbound scheduler {field}", kind, (),
+                           lambda field=field: {(): outbound.stats()[field]})
+
+
+_register_collectors()
+
+STATS_TOP = 5
+
+
+def format_latency(title: str, name: str, limit: int = STATS_TOP) -> List[str]:
+    """أكثر التسميات استدعاءً في الهيستوغرام مع p50 و p95 بالملي ثانية"""
+    family = REGISTRY.get(name)
+    children = [item for item in family.children() if item[1].count] if family else []
+    children = sorted(children, key=lambda item: -item[1].count)[:limit]
+    lines = [title]
+    for labels, histogram in children:
+        lines.append(f"• {labels[0] if labels else 'all'}: {histogram.count} - "
+                     f"p50 {histogram.quantile(0.5) * 1000:.1f} ms - p95 {histogram.quantile(0.95) * 1000:.1f} ms")
+    if not children:
+        lines.append("• لا توجد بيانات بعد")
+    return lines
+
+
+def format_counter(name: str) -> str:
+    family = REGISTRY.get(name)
+    values = [f"{labels[0]}={counter.value}" for labels, counter in family.children()] if family else []
+    return ", ".join(values) or "0"
+
+
+@dp.message_handler(commands=['stats'])
+async def show_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("⛔ هذا الأمر متاح للمشرفين فقط!")
+        return
+    lines = ["📈 إحصائيات الأداء", ""]
+    lines += format_latency("⏱️ التحديثات:", "bot_update_seconds")
+    lines += format_latency("🧩 المعالجات:", "bot_handler_seconds")
+    lines += format_latency("🗄️ قاعدة البيانات:", "storage_call_seconds")
+    lines += format_latency("📡 Telegram API:", "telegram_api_seconds")
+    lines += [
+        "",
+        f"💾 الملفات المستلمة: {format_counter('files_saved')}",
+        f"🔎 الملفات المسترجعة: {format_counter('file_lookups')}",
+        f"🚨 الأخطاء: {format_counter('bot_update_errors')}",
+        f"🧠 الذاكرة المؤقتة: {cache_stats()}",
+        f"📤 الإرسال: {outbound.stats()}",
+    ]
+    slowest = profiler.slowest()[:3]
+    if slowest:
+        lines += ["", "🐢 أبطأ التحديثات:"]
+        for entry in slowest:
+            lines.append(f"• {entry['ms']} ms - {entry['handler'] or entry['type']} - {entry['breakdown_ms']}")
+    await message.reply("\n".join(lines))
+
+CACHE_STATS_INTERVAL = 600
+
+
+async def log_cache_stats():
+    while True:
+        await asyncio.sleep(CACHE_STATS_INTERVAL)
+        logger.info(f"📊 ذاكرة الملفات المؤقتة: {storage.file_cache.stats()} - الصفحات: {page_cache.stats()}")
+
+
+async def on_startup(dispatcher: Dispatcher):
     await storage.initialize_db()
-    await dp.start_polling()
+    await ingest.start()
+    await retention.start()
+    await outbound.start()
+    dispatcher["cache_stats_task"] = asyncio.create_task(log_cache_stats())
+    if METRICS_PORT:
+        dispatcher["metrics_runner"] = await start_metrics_server(METRICS_HOST, METRICS_PORT, profiler)
+        logger.info(f"📈 المقاييس متاحة على http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """إيقاف كل ما بدأ تشغيله، حتى لو فشل on_startup في منتصفه
+
+    إغلاق المكونات التي لم تبدأ لا يفعل شيئًا، والمهم إغلاق قاعدة البيانات دائمًا
+    لأن خيوط aiosqlite ليست daemon وتمنع العملية من الخروج.
+    """
+    if dispatcher.get("cache_stats_task"):
+        dispatcher["cache_stats_task"].cancel()
+    if dispatcher.get("metrics_runner"):
+        await dispatcher["metrics_runner"].cleanup()
+    if profiler.slowest():
+        logger.info(f"🐢 أبطأ التحديثات: {profiler.slowest()[:5]}")
+    logger.info(f"📊 ذاكرة الملفات المؤقتة: {storage.file_cache.stats()} - الصفحات: {page_cache.stats()}")
+    await retention.close()
+    await ingest.close()
+    await outbound.close()
+    logger.info(f"📤 الإرسال: {outbound.stats()}")
+    await storage.aclose()
+    # Bot.close() مهملة في aiogram 2.25، فتُغلق جلسة HTTP مباشرة
+    await (await dispatcher.bot.get_session()).close()
+
+
+async def run_webhook():
+    server = WebhookServer(dp, path=WEBHOOK_PATH, concurrency=WEBHOOK_CONCURRENCY, secret_token=WEBHOOK_SECRET)
+    await server.start(WEBAPP_HOST, WEBAPP_PORT)
+    try:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                              max_connections=min(WEBHOOK_CONCURRENCY, 100))
+        await server.wait_closed()
+    finally:
+        await server.stop()
+
+
+async def main():
+    try:
+        await on_startup(dp)
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # getUpdates يُرفض ما دام هناك webhook مسجل من تشغيل سابق
+            await bot.delete_webhook()
+            await dp.start_polling()
+    finally:
+        await on_shutdown(dp)
 
 if __name__ == "__main__":
     asyncio.run(main())
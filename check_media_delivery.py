@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Dict, List, Set
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from outbound import OutboundScheduler
+
+os.environ.setdefault("BOT_TOKEN", "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw")
+os.environ.update(DB_PATH=os.path.join(tempfile.mkdtemp(), "delivery.db"), LOG_FILE="", METRICS_PORT="0")
+
+DELIVERY_METHODS = ("sendPhoto", "sendVideo", "sendDocument", "sendAudio", "sendAnimation", "sendMediaGroup")
+OWNER, BLOCKED = 111, 222
+
+
+class FakeBotAPI:
+    """خادم محلي يحاكي Bot API ويسجل كل طلب، ويرفض الإرسال إلى محادثات `blocked` بـ 403"""
+
+    def __init__(self, blocked: Set[int]):
+        self.blocked = blocked
+        self.calls: List[Dict] = []
+        self._message_ids = itertools.count(1000)
+        self._runner = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        call = {"method": method, **data}
+        self.calls.append(call)
+        chat_id = int(data.get("chat_id", 0))
+        if method in DELIVERY_METHODS and chat_id in self.blocked:
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot was blocked by the user"}, status=403)
+        if method == "answerCallbackQuery":
+            return web.json_response({"ok": True, "result": True})
+        message = {"message_id": next(self._message_ids), "date": 0, "chat": {"id": chat_id, "type": "private"}}
+        call["reply_message_id"] = message["message_id"]
+        if method == "sendMediaGroup":
+            return web.json_response({"ok": True, "result": [message for _ in json.loads(data["media"])]})
+        return web.json_response({"ok": True, "result": message})
+
+    def since(self, mark: int, method: str) -> List[Dict]:
+        return [call for call in self.calls[mark:] if call["method"] == method]
+
+
+class Chat:
+    """مستخدم وهمي يرسل تحديثات إلى البوت مباشرة عبر Dispatcher"""
+
+    updates = itertools.count(1)
+
+    def __init__(self, vault, user_id: int):
+        self.vault = vault
+        self.user = {"id": user_id, "is_bot": False, "first_name": "user"}
+        self.chat = {"id": user_id, "type": "private"}
+        self.callbacks: Set[str] = set()
+
+    async def send(self, **message):
+        n = next(self.updates)
+        await self.vault.dp.process_update(types.Update(**{
+            "update_id": n,
+            "message": {"message_id": n, "date": 0, "chat": self.chat, "from": self.user, **message},
+        }))
+
+    async def command(self, text: str):
+        await self.send(text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}])
+
+    async def document(self, name: str):
+        await self.send(document={"file_id": f"{name}-id", "file_unique_id": f"{name}-unique",
+                                  "file_name": f"{name}.pdf", "mime_type": "application/pdf", "file_size": 1024})
+
+    async def press(self, message_id: int, data: str):
+        n = next(self.updates)
+        self.callbacks.add(str(n))
+        await self.vault.dp.process_update(types.Update(**{
+            "update_id": n,
+            "callback_query": {"id": str(n), "from": self.user, "chat_instance": "check", "data": data,
+                               "message": {"message_id": message_id, "date": 0, "chat": self.chat, "text": "📂"}},
+        }))
+
+
+def album_sizes(calls: List[Dict]) -> List[int]:
+    return [len(json.loads(call["media"])) for call in calls]
+
+
+async def check() -> List[str]:
+    # بعد ضبط متغيرات البيئة أعلاه لأن bot يقرأها عند الاستيراد
+    import bot as vault
+
+    # الإرسال يمر بالمجدول كما في البوت، لكن بحدود واسعة حتى لا ينتظر الاختبار حدود Telegram الفعلية
+    vault.outbound = vault.bot.scheduler = OutboundScheduler(global_rate=1000, global_burst=1000,
+                                                             chat_rate=1000, chat_burst=1000)
+    api = FakeBotAPI(blocked={BLOCKED})
+    vault.bot.server = TelegramAPIServer.from_base(await api.start())
+    Bot.set_current(vault.bot)
+    Dispatcher.set_current(vault.dp)
+    await vault.on_startup(vault.dp)
+    failures = []
+    try:
+        owner, blocked = Chat(vault, OWNER), Chat(vault, BLOCKED)
+        for n in range(23):
+            await owner.document(f"owner-{n}")
+        for n in range(3):
+            await blocked.document(f"blocked-{n}")
+
+        # /play 23: ثلاثة ألبومات 10 + 10 + 3 من الأقدم إلى الأحدث، بدون أي إرسال فردي
+        mark = len(api.calls)
+        await owner.command("/play 23")
+        albums = api.since(mark, "sendMediaGroup")
+        if album_sizes(albums) != [10, 10, 3]:
+            failures.append(f"/play 23 أرسل ألبومات بأحجام {album_sizes(albums)} بدل [10, 10, 3]")
+        sent = [item["media"] for call in albums for item in json.loads(call["media"])]
+        if sent != [f"owner-{n}-id" for n in range(23)]:
+            failures.append("/play 23 لم يرسل الملفات بترتيبها من الأقدم إلى الأحدث")
+        if api.since(mark, "sendDocument"):
+            failures.append("/play 23 أرسل ملفات فردية بدل الألبومات")
+
+        # التحديد من القائمة: 12 ملفًا تصل في ألبومين 10 + 2
+        mark = len(api.calls)
+        await owner.command("/list_files")
+        listing = api.since(mark, "sendMessage")[-1]["reply_message_id"]
+        await owner.press(listing, "select_on")
+        for pk in range(1, 13):
+            await owner.press(listing, f"pick_{pk}")
+        await owner.press(listing, "select_send")
+        if album_sizes(api.since(mark, "sendMediaGroup")) != [10, 2]:
+            failures.append(f"إرسال المحدد أرسل ألبومات بأحجام {album_sizes(api.since(mark, 'sendMediaGroup'))} بدل [10, 2]")
+
+        # مستخدم حظر البوت: الإرسال يفشل بـ 403 ويجب أن يصله رد واضح دون استثناء غير معالج
+        mark = len(api.calls)
+        await blocked.command("/play 3")
+        replies = [call["text"] for call in api.since(mark, "sendMessage")]
+        if "❌ حدث خطأ أثناء استرجاع الملف!" not in replies:
+            failures.append(f"/play لم يبلغ عن فشل الإرسال: {replies}")
+
+        mark = len(api.calls)
+        await blocked.command("/list_files")
+        listing = api.since(mark, "sendMessage")[-1]["reply_message_id"]
+        await blocked.press(listing, "select_on")
+        await blocked.press(listing, f"pick_{24}")
+        await blocked.press(listing, "select_send")
+        answers = [call.get("text") for call in api.since(mark, "answerCallbackQuery")]
+        if answers[-1:] != ["❌ حدث خطأ أثناء استرجاع الملفات!"]:
+            failures.append(f"إرسال المحدد لم يبلغ عن فشل الإرسال: {answers}")
+
+        # كل ضغطة زر يجب أن تُجاب حتى لا يبقى مؤشر التحميل ظاهرًا
+        answered = {call["callback_query_id"] for call in api.calls if call["method"] == "answerCallbackQuery"}
+        missing = (owner.callbacks | blocked.callbacks) - answered
+        if missing:
+            failures.append(f"{len(missing)} ضغطة زر بدون answerCallbackQuery")
+    finally:
+        await vault.on_shutdown(vault.dp)
+        await api.close()
+    return failures
+
+
+def main() -> int:
+    # أخطاء الإرسال إلى المستخدم المحظور متوقعة في هذا الاختبار
+    logging.disable(logging.ERROR)
+    failures = asyncio.run(check())
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ /play والتحديد من القائمة يرسلان ألبومات من 10، وكل فشل يصل للمستخدم وكل زر يُجاب")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_common import build_vault, latency_summary
+from database import AsyncMediaStorage
+
+PAGE_SIZE = 10
+# عدد الصفحات التي يُقارن متوسطها في بداية القائمة ونهايتها
+SAMPLE_PAGES = 200
+
+
+def add_album(path: str, size: int):
+    """ملفات بنفس created_at تمامًا كما يحدث عند حفظ ألبوم في ثانية واحدة، لاختبار فصل التعادل بـ id"""
+    conn = sqlite3.connect(path)
+    pk, created_at = conn.execute("SELECT MAX(id), MAX(created_at) FROM media_files").fetchone()
+    with conn:
+        conn.executemany('''
+            INSERT INTO media_files (id, file_id, file_type, user_id, meta_data, created_at)
+            VALUES (?, ?, 'document', 1, '{}', ?)
+        ''', [(pk + n, f"album-{n}", created_at) for n in range(1, size + 1)])
+    total = conn.execute("SELECT COUNT(*) FROM media_files WHERE user_id = 1").fetchone()[0]
+    conn.close()
+    return total
+
+
+async def walk(storage: AsyncMediaStorage):
+    """المرور على كل الصفحات من الأحدث إلى الأقدم بمؤشر before وإرجاع الصفحات وزمن كل منها"""
+    pages, times, cursor = [], [], None
+    while True:
+        started = time.perf_counter()
+        files = await storage.alist_files(1, limit=PAGE_SIZE, before=cursor)
+        times.append(time.perf_counter() - started)
+        if not files:
+            return pages, times[:-1]
+        pages.append([(pk, created_at) for pk, _, _, created_at in files])
+        cursor = tuple(reversed(pages[-1][-1]))
+
+
+async def check(path: str) -> int:
+    total = add_album(path, 3 * PAGE_SIZE + 7)
+    storage = AsyncMediaStorage(path, file_cache_size=0)
+    await storage.initialize_db()
+    try:
+        pages, times = await walk(storage)
+        # الرجوع بمؤشر after من أول ملف في صفحة يجب أن يعيد الصفحة التي قبلها تمامًا
+        middle = len(pages) // 2
+        pk, created_at = pages[middle][0]
+        back = await storage.alist_files(1, limit=PAGE_SIZE, after=(created_at, pk))
+    finally:
+        await storage.aclose()
+
+    seen = [pk for page in pages for pk, _ in page]
+    failures = []
+    if len(seen) != len(set(seen)):
+        failures.append(f"{len(seen) - len(set(seen))} ملف مكرر")
+    if len(set(seen)) != total:
+        failures.append(f"تمت زيارة {len(set(seen))} من {total} ملف")
+    if [(pk, created_at) for pk, _, _, created_at in back] != pages[middle - 1]:
+        failures.append("الصفحة الأحدث بمؤشر after لا تطابق صفحة before")
+
+    early, deep = times[:SAMPLE_PAGES], times[-SAMPLE_PAGES:]
+    early_avg, deep_avg = sum(early) / len(early), sum(deep) / len(deep)
+    print(f"📄 {len(pages)} صفحة، {len(seen)} ملف")
+    print(f"أول {SAMPLE_PAGES} صفحة: {latency_summary(early)} - آخر {SAMPLE_PAGES} صفحة: {latency_summary(deep)}")
+    print(f"نسبة متوسط الصفحات العميقة إلى الأولى: {deep_avg / early_avg:.2f}")
+    # التكلفة الثابتة تعني نسبة قريبة من 1؛ الحد 3 يترك مجالًا للضجيج، وOFFSET يعطي مئات المرات
+    if deep_avg > 3 * early_avg:
+        failures.append("تكلفة الصفحات العميقة تزداد مع العمق")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ لا تكرار ولا فجوات، وتكلفة الصفحة ثابتة")
+    return 1 if failures else 0
+
+
+def main(rows: int = 100_000, path: str = None) -> int:
+    path = path or os.path.join(tempfile.mkdtemp(), "vault.db")
+    asyncio.run(build_vault(path, rows))
+    return asyncio.run(check(path))
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000, sys.argv[2] if len(sys.argv) > 2 else None))
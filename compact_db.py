@@ -0,0 +1,23 @@
+import asyncio
+import sys
+
+from database import AsyncMediaStorage
+
+
+async def main(db_path: str):
+    """دمج الملفات المكررة في قاعدة بيانات موجودة وطباعة حجم التوفير"""
+    storage = AsyncMediaStorage(db_path)
+    await storage.initialize_db()
+    try:
+        stats = await storage.acompact_duplicates()
+    finally:
+        await storage.aclose()
+
+    before, after = stats["before"], stats["after"]
+    print(f"📄 الصفوف: {before['files']} ← {after['files']}")
+    print(f"🧩 النسخ الفريدة: {after['blobs']}")
+    print(f"💾 الحجم: {before['bytes']} ← {after['bytes']} بايت")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "media.db"))
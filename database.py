@@ -1,7 +1,13 @@
+import asyncio
 import aiosqlite
 import json
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, AsyncIterator
+
+from cache import LRUCache
+from metrics import REGISTRY, timed
 
 
 class DatabaseError(Exception):
@@ -9,76 +15,580 @@ class DatabaseError(Exception):
     pass
 
 
+class SQLitePool:
+    """مدير اتصالات دائم: اتصال كتابة واحد ومجموعة صغيرة من اتصالات القراءة"""
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -16000",
+        "PRAGMA mmap_size = 134217728",
+        "PRAGMA foreign_keys = ON",
+    )
+    # مع NORMAL قد يضيع آخر تثبيت في WAL عند انقطاع الكهرباء بعد إرسال تأكيد الحفظ،
+    # و FULL يزامن الملف عند كل تثبيت، أي مرة واحدة لكل دفعة من طابور الحفظ
+    WRITER_PRAGMAS = ("PRAGMA synchronous = FULL",)
+
+    def __init__(self, db_path: str, readers: int = 4):
+        self.db_path = db_path
+        self.readers = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, extra: Tuple[str, ...] = ()) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        for pragma in self.PRAGMAS + extra:
+            await conn.execute(pragma)
+        return conn
+
+    async def open(self):
+        """فتح اتصال الكتابة واتصالات القراءة مرة واحدة طوال عمر البوت"""
+        if self.is_open:
+            return
+        self._writer = await self._connect(self.WRITER_PRAGMAS)
+        self._idle_readers = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await self._connect()
+            self._reader_conns.append(conn)
+            self._idle_readers.put_nowait(conn)
+
+    async def close(self):
+        """إغلاق جميع الاتصالات بعد إنهاء أي عملية كتابة جارية"""
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._reader_conns:
+                await conn.close()
+            await self._writer.close()
+            self._reader_conns = []
+            self._idle_readers = None
+            self._writer = None
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """معاملة كتابة حصرية على اتصال الكتابة، تُثبَّت تلقائيًا عند النجاح"""
+        if not self.is_open:
+            raise DatabaseError("قاعدة البيانات غير مفتوحة")
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """استعارة اتصال قراءة من المجموعة وإعادته بعد الاستخدام"""
+        if not self.is_open:
+            raise DatabaseError("قاعدة البيانات غير مفتوحة")
+        conn = await self._idle_readers.get()
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put_nowait(conn)
+
+
+# توحيد أشكال الحروف العربية وإزالة التشكيل والتطويل قبل الفهرسة والبحث،
+# لأن مُجزِّئ unicode61 لا يزيل علامات التشكيل العربية
+ARABIC_FOLD = {
+    **{chr(code): "" for code in range(0x064B, 0x0653)},
+    "\u0670": "", "\u0640": "",
+    "\u0622": "\u0627", "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627",
+    "\u0649": "\u064A",
+}
+_ARABIC_FOLD_TABLE = str.maketrans(ARABIC_FOLD)
+_SEARCH_TOKEN = re.compile(r"\w+")
+
+
+def normalize_arabic(text: str) -> str:
+    """تطبيق نفس توحيد الحروف المستخدم في فهرس البحث على نص من بايثون"""
+    return text.translate(_ARABIC_FOLD_TABLE)
+
+
+def age_threshold(days: int) -> str:
+    """حد `created_at` للملفات الأقدم من عدد معين من الأيام، بنفس تنسيق SQLite"""
+    return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _fold_sql(expr: str) -> str:
+    """بناء تعبير SQL يطبق ARABIC_FOLD عبر REPLACE متداخلة"""
+    for source, target in ARABIC_FOLD.items():
+        expr = f"REPLACE({expr}, '{source}', '{target}')"
+    return expr
+
+
+def _meta_sql(row: str, key: str) -> str:
+    """استخراج حقل نصي من meta_data مع تجاهل الصفوف القديمة غير الصالحة كـ JSON"""
+    return _fold_sql(
+        f"CASE WHEN json_valid({row}.meta_data) THEN json_extract({row}.meta_data, '$.{key}') END"
+    )
+
+
+def _search_index_values(row: str) -> str:
+    return ", ".join(_meta_sql(row, key) for key in ("file_name", "mime_type", "caption"))
+
+
+# كل ترحيل يُطبَّق مرة واحدة بالترتيب، ورقم آخر ترحيل يُحفظ في PRAGMA user_version
+MIGRATIONS: Tuple[Tuple[int, Tuple[str, ...]], ...] = (
+    (1, (
+        '''
+        CREATE TABLE IF NOT EXISTS media_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            user_id INTEGER,
+            meta_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (2, (
+        "CREATE INDEX IF NOT EXISTS idx_media_files_created_at ON media_files (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_media_files_user_created ON media_files (user_id, created_at)",
+    )),
+    (3, (
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS media_search USING fts5(
+            file_name, mime_type, caption,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS media_files_search_insert AFTER INSERT ON media_files BEGIN
+            INSERT INTO media_search (rowid, file_name, mime_type, caption)
+            VALUES (new.id, {_search_index_values("new")});
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS media_files_search_delete AFTER DELETE ON media_files BEGIN
+            DELETE FROM media_search WHERE rowid = old.id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS media_files_search_update AFTER UPDATE OF meta_data ON media_files BEGIN
+            DELETE FROM media_search WHERE rowid = old.id;
+            INSERT INTO media_search (rowid, file_name, mime_type, caption)
+            VALUES (new.id, {_search_index_values("new")});
+        END
+        ''',
+        f'''
+        INSERT INTO media_search (rowid, file_name, mime_type, caption)
+        SELECT media_files.id, {_search_index_values("media_files")} FROM media_files
+        ''',
+    )),
+    (4, (
+        # نسخة واحدة لكل محتوى حسب file_unique_id، وصفوف media_files تصبح مراجع إليها
+        '''
+        CREATE TABLE IF NOT EXISTS media_blobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_unique_id TEXT UNIQUE,
+            file_id TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            file_size INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_media_blobs_file_id ON media_blobs (file_id)",
+        "ALTER TABLE media_files ADD COLUMN blob_id INTEGER REFERENCES media_blobs (id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_media_files_user_blob ON media_files (user_id, blob_id)",
+    )),
+    (5, (
+        "CREATE INDEX IF NOT EXISTS idx_media_files_blob ON media_files (blob_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            user_id INTEGER PRIMARY KEY,
+            ttl_days INTEGER NOT NULL
+        )
+        ''',
+    )),
+)
+
+# صف حفظ: (file_id, file_type, user_id, meta_data, file_unique_id, file_size)
+SaveRow = Tuple[str, str, Optional[int], Optional[dict], Optional[str], Optional[int]]
+
+
+_MISSING = object()
+
+# زمن كل استدعاء لطبقة التخزين وعدد أخطائه، حسب اسم الدالة
+_timed = timed(
+    REGISTRY.histogram("storage_call_seconds", "Duration of AsyncMediaStorage calls", ("method",)),
+    REGISTRY.counter("storage_errors", "Failed AsyncMediaStorage calls", ("method",)),
+    kind="storage",
+)
+
+
 class AsyncMediaStorage:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, readers: int = 4, file_cache_size: int = 2048, file_cache_ttl: float = 600):
         self.db_path = db_path
+        self.pool = SQLitePool(db_path, readers=readers)
+        # ("file", id) -> (file_id, file_type, user_id) و ("latest", user_id) -> (file_id, file_type) أو None
+        self.file_cache = LRUCache(maxsize=file_cache_size, ttl=file_cache_ttl)
 
     async def initialize_db(self):
-        """تهيئة قاعدة البيانات وإنشاء الجدول"""
+        """تهيئة قاعدة البيانات وتطبيق الترحيلات المعلقة"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    CREATE TABLE IF NOT EXISTS media_files (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        file_id TEXT NOT NULL,
-                        file_type TEXT NOT NULL,
-                        user_id INTEGER,
-                        meta_data TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                await db.commit()
+            await self.pool.open()
+            await self._migrate()
+            await self._enable_incremental_vacuum()
         except Exception as e:
+            # خيوط aiosqlite ليست daemon، فالاتصالات المفتوحة تمنع العملية من الخروج
+            await self.pool.close()
             raise DatabaseError(f"فشل في تهيئة قاعدة البيانات: {e}")
 
-    async def asave_file(self, file_id: str, file_type: str, user_id: Optional[int] = None, meta_data: Optional[dict] = None):
-        """حفظ ملف في قاعدة البيانات"""
+    async def _enable_incremental_vacuum(self):
+        """تفعيل auto_vacuum=INCREMENTAL، ويتطلب VACUUM كاملًا مرة واحدة للقواعد القديمة"""
+        async with self.pool.write() as db:
+            async with db.execute("PRAGMA auto_vacuum") as cursor:
+                (mode,) = await cursor.fetchone()
+            if mode != 2:
+                await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                await db.execute("VACUUM")
+
+    async def _migrate(self):
+        """تطبيق الترحيلات التي لم تُطبَّق بعد، كل ترحيل في معاملة مستقلة"""
+        async with self.pool.read() as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                (current,) = await cursor.fetchone()
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            async with self.pool.write() as db:
+                await db.execute("BEGIN")
+                for statement in statements:
+                    await db.execute(statement)
+                await db.execute(f"PRAGMA user_version = {version:d}")
+
+    async def aclose(self):
+        """إغلاق اتصالات قاعدة البيانات عند إيقاف البوت"""
+        await self.pool.close()
+
+    async def asave_file(self, file_id: str, file_type: str, user_id: Optional[int] = None, meta_data: Optional[dict] = None,
+                         file_unique_id: Optional[str] = None, file_size: Optional[int] = None) -> bool:
+        """حفظ ملف في قاعدة البيانات، وإرجاع False إذا كان المستخدم قد حفظه من قبل"""
+        (saved,) = await self.asave_files([(file_id, file_type, user_id, meta_data, file_unique_id, file_size)])
+        return saved
+
+    @_timed
+    async def asave_files(self, rows: List[SaveRow]) -> List[bool]:
+        """حفظ دفعة من الملفات في معاملة واحدة مع دمج المحتوى المكرر
+
+        الملف المعروف مسبقًا (نفس file_unique_id) لا يُنشئ نسخة جديدة في media_blobs،
+        بل مرجعًا جديدًا فقط، ولا يُنشأ مرجع ثانٍ لنفس المستخدم. النسخ القديمة بلا
+        file_unique_id تُطابق حسب file_id ويُكمَل معرّفها عند أول إعادة إرسال.
+        """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    INSERT INTO media_files (file_id, file_type, user_id, meta_data)
-                    VALUES (?, ?, ?, ?)
-                ''', (file_id, file_type, user_id, json.dumps(meta_data) if meta_data else None))
-                await db.commit()
+            saved = []
+            async with self.pool.write() as db:
+                for file_id, file_type, user_id, meta_data, file_unique_id, file_size in rows:
+                    blob_id = None
+                    if file_unique_id:
+                        async with db.execute(
+                            "SELECT id, file_id FROM media_blobs WHERE file_unique_id = ?", (file_unique_id,)
+                        ) as cursor:
+                            blob = await cursor.fetchone()
+                        if not blob:
+                            # نسخة أنشأها acompact_duplicates من صفوف قديمة بلا file_unique_id
+                            async with db.execute(
+                                "SELECT id, file_id FROM media_blobs WHERE file_id = ? AND file_unique_id IS NULL LIMIT 1",
+                                (file_id,)
+                            ) as cursor:
+                                blob = await cursor.fetchone()
+                            if blob:
+                                await db.execute(
+                                    "UPDATE media_blobs SET file_unique_id = ?, file_size = COALESCE(file_size, ?) WHERE id = ?",
+                                    (file_unique_id, file_size, blob[0])
+                                )
+                        if blob:
+                            blob_id, file_id = blob
+                        else:
+                            cursor = await db.execute('''
+                                INSERT INTO media_blobs (file_unique_id, file_id, file_type, file_size)
+                                VALUES (?, ?, ?, ?)
+                            ''', (file_unique_id, file_id, file_type, file_size))
+                            blob_id = cursor.lastrowid
+                    cursor = await db.execute('''
+                        INSERT INTO media_files (file_id, file_type, user_id, meta_data, blob_id)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (user_id, blob_id) DO NOTHING
+                    ''', (file_id, file_type, user_id, json.dumps(meta_data) if meta_data else None, blob_id))
+                    saved.append(cursor.rowcount > 0)
+            # الإبطال بعد التثبيت حتى لا يُخزَّن مؤقتًا ما قرأه قارئ قبل اكتمال المعاملة
+            for (_, _, user_id, _, _, _), is_new in zip(rows, saved):
+                if is_new:
+                    self.file_cache.pop(("latest", user_id))
+            return saved
+        except Exception as e:
+            raise DatabaseError(f"فشل في حفظ دفعة الملفات: {e}")
+
+    @_timed
+    async def alist_files(self, user_id: int, limit: int = 10, before: Optional[Tuple[str, int]] = None,
+                          after: Optional[Tuple[str, int]] = None) -> List[Tuple[int, str, Optional[str], str]]:
+        """إرجاع صفحة من ملفات المستخدم من الأحدث إلى الأقدم باستخدام مؤشر (created_at, id)
+
+        `before` يجلب الملفات الأقدم من المؤشر و`after` يجلب الأحدث منه، دون OFFSET
+        حتى تبقى تكلفة كل صفحة ثابتة مهما كان عمقها.
+        """
+        try:
+            async with self.pool.read() as db:
+                if after is not None:
+                    async with db.execute('''
+                        SELECT id, file_type, meta_data, created_at
+                        FROM media_files
+                        WHERE user_id = ? AND (created_at, id) > (?, ?)
+                        ORDER BY created_at ASC, id ASC
+                        LIMIT ?
+                    ''', (user_id, *after, limit)) as cursor:
+                        return list(reversed(await cursor.fetchall()))
+                async with db.execute('''
+                    SELECT id, file_type, meta_data, created_at
+                    FROM media_files
+                    WHERE user_id = ? AND (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', (user_id, *(before or ("9999-12-31", 0)), limit)) as cursor:
+                    return await cursor.fetchall()
         except Exception as e:
-            raise DatabaseError(f"فشل في حفظ الملف: {e}")
+            raise DatabaseError(f"خطأ أثناء جلب قائمة الملفات: {e}")
+
+    @_timed
+    async def aget_file(self, pk: int, user_id: int) -> Optional[Tuple[str, str]]:
+        """إرجاع ملف محدد حسب رقمه، أو None إذا لم يكن ملكًا للمستخدم"""
+        row = self.file_cache.get(("file", pk), _MISSING)
+        if row is _MISSING:
+            generation = self.file_cache.generation
+            try:
+                async with self.pool.read() as db:
+                    async with db.execute('''
+                        SELECT file_id, file_type, user_id
+                        FROM media_files
+                        WHERE id = ?
+                    ''', (pk,)) as cursor:
+                        row = await cursor.fetchone()
+            except Exception as e:
+                raise DatabaseError(f"خطأ أثناء جلب الملف: {e}")
+            self.file_cache.set(("file", pk), row, generation=generation)
+        if row is None or row[2] != user_id:
+            return None
+        return row[0], row[1]
 
-    async def aget_latest_file(self) -> Optional[Tuple[str, str]]:
-        """إرجاع آخر ملف مخزن"""
+    @_timed
+    async def aget_latest_file(self, user_id: int) -> Optional[Tuple[str, str]]:
+        """إرجاع آخر ملف خزنه المستخدم"""
+        row = self.file_cache.get(("latest", user_id), _MISSING)
+        if row is not _MISSING:
+            return row
+        generation = self.file_cache.generation
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute('''
-                    SELECT file_id, file_type 
-                    FROM media_files 
-                    ORDER BY created_at DESC 
+            async with self.pool.read() as db:
+                async with db.execute('''
+                    SELECT file_id, file_type
+                    FROM media_files
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC, id DESC
                     LIMIT 1
-                ''')
-                return await cursor.fetchone()
+                ''', (user_id,)) as cursor:
+                    row = await cursor.fetchone()
         except Exception as e:
             raise DatabaseError(f"خطأ أثناء استرجاع آخر ملف: {e}")
+        self.file_cache.set(("latest", user_id), row, generation=generation)
+        return row
+
+    @_timed
+    async def alist_latest_files(self, user_id: int, limit: int) -> List[Tuple[str, str]]:
+        """إرجاع (file_id, file_type) لآخر الملفات التي خزنها المستخدم، من الأحدث إلى الأقدم"""
+        try:
+            async with self.pool.read() as db:
+                async with db.execute('''
+                    SELECT file_id, file_type
+                    FROM media_files
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', (user_id, limit)) as cursor:
+                    return await cursor.fetchall()
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء استرجاع آخر الملفات: {e}")
 
-    async def asearch_files(self, query: str) -> List[Tuple[str, str, dict]]:
-        """البحث عن الملفات باستخدام `meta_data` أو `file_type`"""
+    @_timed
+    async def asearch_files(self, query: str, user_id: int, limit: int = 10, offset: int = 0) -> List[Tuple[int, str, Optional[str]]]:
+        """البحث النصي الكامل في ملفات المستخدم حسب الاسم والنوع والتعليق، مرتبًا حسب الصلة"""
+        tokens = _SEARCH_TOKEN.findall(normalize_arabic(query))
+        if not tokens:
+            return []
+        # كل كلمة تُطابَق كبادئة، والكلمات مجتمعة بشرط AND
+        match = " ".join(f'"{token}"*' for token in tokens)
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute('''
-                    SELECT file_id, file_type, meta_data 
-                    FROM media_files 
-                    WHERE meta_data LIKE ? OR file_type LIKE ?
-                ''', (f"%{query}%", f"%{query}%"))
-                results = await cursor.fetchall()
-                return [(file_id, file_type, json.loads(meta_data) if meta_data else {}) for file_id, file_type, meta_data in results]
+            async with self.pool.read() as db:
+                async with db.execute('''
+                    SELECT media_files.id, media_files.file_type,
+                           json_extract(media_files.meta_data, '$.file_name')
+                    FROM media_search
+                    JOIN media_files ON media_files.id = media_search.rowid
+                    WHERE media_search MATCH ? AND media_files.user_id = ?
+                    ORDER BY media_search.rank
+                    LIMIT ? OFFSET ?
+                ''', (match, user_id, limit, offset)) as cursor:
+                    return await cursor.fetchall()
         except Exception as e:
             raise DatabaseError(f"خطأ أثناء البحث عن الملفات: {e}")
 
-    async def adelete_old_files(self, days: int):
-        """حذف الملفات الأقدم من عدد معين من الأيام"""
+    @_timed
+    async def adelete_batch(self, user_id: int, threshold: str, limit: int) -> List[int]:
+        """حذف دفعة محدودة من أقدم ملفات المستخدم قبل `threshold` وإرجاع أرقامها
+
+        `threshold` بتنسيق 'YYYY-MM-DD' أو 'YYYY-MM-DD HH:MM:SS'؛ المقارنة النصية
+        المباشرة مع created_at تكافئ المقارنة بالتاريخ وتستفيد من الفهرس.
+        """
         try:
-            threshold_date = datetime.utcnow() - timedelta(days=days)
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute('''
-                    DELETE FROM media_files WHERE created_at < ?
-                ''', (threshold_date.strftime('%Y-%m-%d %H:%M:%S'),))
-                await db.commit()
+            async with self.pool.write() as db:
+                async with db.execute('''
+                    DELETE FROM media_files
+                    WHERE id IN (
+                        SELECT id FROM media_files
+                        WHERE user_id = ? AND created_at < ?
+                        ORDER BY created_at, id
+                        LIMIT ?
+                    )
+                    RETURNING id, blob_id
+                ''', (user_id, threshold, limit)) as cursor:
+                    deleted = await cursor.fetchall()
+                blob_ids = sorted({blob_id for _, blob_id in deleted if blob_id is not None})
+                if blob_ids:
+                    # حذف النسخ التي لم يعد يشير إليها أي مستخدم
+                    await db.execute(f'''
+                        DELETE FROM media_blobs
+                        WHERE id IN ({", ".join("?" * len(blob_ids))})
+                          AND NOT EXISTS (SELECT 1 FROM media_files WHERE media_files.blob_id = media_blobs.id)
+                    ''', blob_ids)
+            for pk, _ in deleted:
+                self.file_cache.pop(("file", pk))
+            if deleted:
+                self.file_cache.pop(("latest", user_id))
+            return [pk for pk, _ in deleted]
         except Exception as e:
             raise DatabaseError(f"خطأ أثناء حذف الملفات القديمة: {e}")
+
+    @_timed
+    async def aincremental_vacuum(self, pages: int) -> int:
+        """إعادة عدد محدود من الصفحات الفارغة إلى نظام الملفات وإرجاع المتبقي منها"""
+        try:
+            async with self.pool.write() as db:
+                # execute() ينفذ خطوة واحدة فقط من هذا الأمر (صفحة واحدة)، لذا نستخدم executescript
+                await db.executescript(f"PRAGMA incremental_vacuum({pages:d});")
+                async with db.execute("PRAGMA freelist_count") as cursor:
+                    (remaining,) = await cursor.fetchone()
+            return remaining
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء تقليص قاعدة البيانات: {e}")
+
+    @_timed
+    async def aset_retention_policy(self, user_id: int, ttl_days: int):
+        """تحديد مدة الاحتفاظ بملفات المستخدم قبل حذفها تلقائيًا"""
+        try:
+            async with self.pool.write() as db:
+                await db.execute('''
+                    INSERT INTO retention_policies (user_id, ttl_days) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET ttl_days = excluded.ttl_days
+                ''', (user_id, ttl_days))
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء حفظ سياسة الاحتفاظ: {e}")
+
+    @_timed
+    async def aclear_retention_policy(self, user_id: int):
+        """إلغاء الحذف التلقائي لملفات المستخدم"""
+        try:
+            async with self.pool.write() as db:
+                await db.execute("DELETE FROM retention_policies WHERE user_id = ?", (user_id,))
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء حذف سياسة الاحتفاظ: {e}")
+
+    @_timed
+    async def aget_retention_policy(self, user_id: int) -> Optional[int]:
+        """إرجاع مدة الاحتفاظ بالأيام للمستخدم، أو None إن لم تُحدد"""
+        try:
+            async with self.pool.read() as db:
+                async with db.execute("SELECT ttl_days FROM retention_policies WHERE user_id = ?", (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء جلب سياسة الاحتفاظ: {e}")
+
+    @_timed
+    async def alist_retention_policies(self) -> List[Tuple[int, int]]:
+        """إرجاع جميع سياسات الاحتفاظ (user_id, ttl_days)"""
+        try:
+            async with self.pool.read() as db:
+                async with db.execute("SELECT user_id, ttl_days FROM retention_policies") as cursor:
+                    return await cursor.fetchall()
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء جلب سياسات الاحتفاظ: {e}")
+
+    @_timed
+    async def acompact_duplicates(self) -> dict:
+        """دمج الصفوف المكررة في قاعدة بيانات قديمة ثم تقليص الملف بـ VACUUM
+
+        الصفوف السابقة لـ file_unique_id تُدمج حسب file_id المطابق، ويُحتفظ بأقدم
+        رفع لكل مستخدم.
+        """
+        try:
+            async with self.pool.write() as db:
+                stats = await self._count_storage(db)
+                # رفع مكرر لنفس المستخدم ونفس file_id
+                await db.execute('''
+                    DELETE FROM media_files
+                    WHERE blob_id IS NULL AND id NOT IN (
+                        SELECT MIN(id) FROM media_files WHERE blob_id IS NULL GROUP BY user_id, file_id
+                    )
+                ''')
+                # صف قديم يكرر مرجعًا موجودًا للمستخدم نفسه
+                await db.execute('''
+                    DELETE FROM media_files
+                    WHERE blob_id IS NULL AND EXISTS (
+                        SELECT 1 FROM media_files AS ref
+                        JOIN media_blobs ON media_blobs.id = ref.blob_id
+                        WHERE ref.user_id = media_files.user_id AND media_blobs.file_id = media_files.file_id
+                    )
+                ''')
+                await db.execute('''
+                    INSERT INTO media_blobs (file_id, file_type)
+                    SELECT file_id, MIN(file_type) FROM media_files
+                    WHERE blob_id IS NULL
+                      AND file_id NOT IN (SELECT file_id FROM media_blobs)
+                    GROUP BY file_id
+                ''')
+                await db.execute('''
+                    UPDATE media_files
+                    SET blob_id = (
+                        SELECT MIN(id) FROM media_blobs WHERE media_blobs.file_id = media_files.file_id
+                    )
+                    WHERE blob_id IS NULL
+                ''')
+                await db.execute('''
+                    DELETE FROM media_blobs
+                    WHERE id NOT IN (SELECT blob_id FROM media_files WHERE blob_id IS NOT NULL)
+                ''')
+            self.file_cache.clear()
+            async with self.pool.write() as db:
+                await db.execute("VACUUM")
+                after = await self._count_storage(db)
+            return {"before": stats, "after": after}
+        except Exception as e:
+            raise DatabaseError(f"خطأ أثناء ضغط قاعدة البيانات: {e}")
+
+    @staticmethod
+    async def _count_storage(db: aiosqlite.Connection) -> dict:
+        async with db.execute('''
+            SELECT (SELECT COUNT(*) FROM media_files),
+                   (SELECT COUNT(*) FROM media_blobs),
+                   (SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size())
+        ''') as cursor:
+            files, blobs, size = await cursor.fetchone()
+        return {"files": files, "blobs": blobs, "bytes": size}
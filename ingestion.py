@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Optional, List, Tuple
+
+from database import AsyncMediaStorage, DatabaseError
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MediaIngestQueue:
+    """طابور كتابة مؤجلة يجمع عمليات حفظ الملفات في معاملة واحدة"""
+
+    def __init__(self, storage: AsyncMediaStorage, batch_size: int = 50, max_pending: int = 1000):
+        self.storage = storage
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._worker: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def start(self):
+        """تشغيل عامل الكتابة في الخلفية"""
+        if self._worker is None:
+            self._closed = False
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """إيقاف استقبال الملفات وكتابة كل ما تبقى في الطابور"""
+        if self._worker is None:
+            return
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._worker
+        self._worker = None
+        self._fail_pending()
+
+    async def submit(self, file_id: str, file_type: str, user_id: Optional[int] = None, meta_data: Optional[dict] = None,
+                     file_unique_id: Optional[str] = None, file_size: Optional[int] = None) -> bool:
+        """إضافة ملف إلى الطابور والانتظار حتى تثبيت الدفعة التي تحتويه
+
+        تُرجع False إذا كان المستخدم قد حفظ نفس المحتوى من قبل.
+        """
+        if self._closed or self._worker is None:
+            raise DatabaseError("طابور الحفظ متوقف")
+        future = asyncio.get_running_loop().create_future()
+        # ينتظر هنا عند امتلاء الطابور، فيتباطأ المرسلون بدل تضخم الذاكرة
+        await self._queue.put(((file_id, file_type, user_id, meta_data, file_unique_id, file_size), future))
+        if self._worker is None or self._worker.done():
+            # أُغلق الطابور أثناء انتظار مكان فيه، ولن يكتب العامل هذا الملف
+            self._fail_pending()
+        return await future
+
+    def _fail_pending(self):
+        """رفض كل ما بقي في الطابور بعد توقف عامل الكتابة"""
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP and not item[1].done():
+                item[1].set_exception(DatabaseError("طابور الحفظ متوقف"))
+
+    async def _collect(self) -> Tuple[List[tuple], bool]:
+        """جمع كل ما في الطابور حتى الحجم الأقصى دون انتظار (group commit)
+
+        الملفات التي تصل أثناء كتابة دفعة تشكل الدفعة التالية، فلا ينتظر ملف وحيد
+        مهلة تجميع، ولا ينتظر مرسلو محادثة واحدة بالترتيب مهلة لكل ملف.
+        """
+        first = await self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _flush(self, batch: List[tuple]):
+        rows = [row for row, _ in batch]
+        try:
+            saved = await self.storage.asave_files(rows)
+        except Exception as e:
+            logger.error(f"🚨 خطأ أثناء حفظ دفعة من {len(rows)} ملفات: {e}")
+            error = e if isinstance(e, DatabaseError) else DatabaseError(str(e))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), is_new in zip(batch, saved):
+            if not future.done():
+                future.set_result(is_new)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+        # أي عناصر وصلت بعد إشارة الإيقاف تُكتب أيضًا قبل الخروج، بما فيها ما أضافه
+        # مرسلون كانوا ينتظرون مكانًا في الطابور أثناء كتابة الدفعات الأخيرة
+        while not self._queue.empty():
+            leftover = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    leftover.append(item)
+            for start in range(0, len(leftover), self.batch_size):
+                await self._flush(leftover[start:start + self.batch_size])
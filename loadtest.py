@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import math
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from aiohttp import ClientSession, TCPConnector, web
+
+from bench_common import TOKEN, latency_summary
+from webhook import SECRET_HEADER
+
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+
+# حدود Telegram المنشورة: (عدد الرسائل، النافذة بالثواني)
+GLOBAL_LIMIT = (30, 1)
+CHAT_LIMIT = (1, 1)
+GROUP_LIMIT = (20, 60)
+DELIVERY_METHODS = ("sendPhoto", "sendVideo", "sendDocument", "sendAudio", "sendAnimation", "sendMediaGroup")
+
+
+class FakeTelegramAPI:
+    """خادم محلي يحاكي Bot API: يقدم التحديثات عبر getUpdates ويسجل وقت وصول كل رد
+
+    مع `enforce_limits` يرد بـ 429 و retry_after عند تجاوز حدود الإرسال كما تفعل Telegram.
+    """
+
+    def __init__(self, rtt: float, slow_chats: int, slow_delay: float, enforce_limits: bool = False):
+        self.rtt = rtt
+        self.slow_chats = slow_chats
+        self.slow_delay = slow_delay
+        self.enforce_limits = enforce_limits
+        self.updates: Deque[dict] = deque()
+        self.new_updates = asyncio.Event()
+        # chat_id ← أوقات إرسال التحديثات التي لم يصل تأكيد حفظها بعد، بالترتيب
+        self.offered: Dict[int, Deque[float]] = defaultdict(deque)
+        self.requested: Dict[int, Deque[float]] = defaultdict(deque)
+        self.ack_latencies: List[float] = []
+        self.delivery_latencies: List[float] = []
+        self.acked_at: List[float] = []
+        self.expected = 0
+        self.messages = 0
+        self.rejected = 0
+        self._windows: Dict[object, Deque[float]] = defaultdict(deque)
+        # يُضبط عندما يسجل البوت الـ webhook أو يحذفه قبل بدء polling
+        self.ready = asyncio.Event()
+        self.webhook_url = None
+        self.done = asyncio.Event()
+        self._message_ids = itertools.count(1)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    def push(self, update: dict):
+        self.updates.append(update)
+        self.new_updates.set()
+
+    def _retry_after(self, chat_id: int, count: int) -> int:
+        """عدد الثواني المطلوب انتظارها إن كان الإرسال يتجاوز الحدود، أو 0"""
+        now = time.perf_counter()
+        checks = [("global", GLOBAL_LIMIT), (chat_id, GROUP_LIMIT if chat_id < 0 else CHAT_LIMIT)]
+        for key, (limit, window) in checks:
+            stamps = self._windows[key]
+            while stamps and stamps[0] <= now - window:
+                stamps.popleft()
+            if len(stamps) + count > max(limit, count):
+                return max(1, math.ceil(stamps[0] + window - now))
+        for key, _ in checks:
+            self._windows[key].extend([now] * count)
+        return 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(data)})
+        await asyncio.sleep(self.rtt)
+        result = True
+        if method == "setWebhook":
+            self.webhook_url = data["url"]
+        if method in ("setWebhook", "deleteWebhook"):
+            self.ready.set()
+        if method.startswith("send"):
+            chat_id = int(data["chat_id"])
+            count = data["media"].count('"type"') if method == "sendMediaGroup" else 1
+            retry_after = self._retry_after(chat_id, count) if self.enforce_limits else 0
+            if retry_after:
+                self.rejected += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+            self.messages += count
+            if 0 < chat_id <= self.slow_chats:
+                await asyncio.sleep(self.slow_delay)
+            self._record(chat_id, method, data.get("text", ""))
+            message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}}
+            result = [message] * count if method == "sendMediaGroup" else message
+        return web.json_response({"ok": True, "result": result})
+
+    def _record(self, chat_id: int, method: str, text: str):
+        now = time.perf_counter()
+        if method in DELIVERY_METHODS:
+            if self.requested[chat_id]:
+                self.delivery_latencies.append(now - self.requested[chat_id].popleft())
+            return
+        if text.startswith("📭") and self.requested[chat_id]:
+            self.requested[chat_id].popleft()
+        if not text.startswith(("✅", "ℹ️")):
+            return
+        # التأكيد المدمج يذكر عدد الملفات، وكل عدد يغطي أقدم التحديثات المنتظرة في المحادثة
+        covered = sum(int(n) for n in re.findall(r"\d+", text)) or 1
+        offered = self.offered[chat_id]
+        for _ in range(min(covered, len(offered))):
+            self.ack_latencies.append(now - offered.popleft())
+            self.acked_at.append(now)
+        if len(self.ack_latencies) >= self.expected:
+            self.done.set()
+
+    async def _get_updates(self, data) -> List[dict]:
+        offset = int(data.get("offset", 0))
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(data.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(self.rtt)
+        return list(itertools.islice(self.updates, int(data.get("limit", 100))))
+
+
+def make_update(n: int, chats: int, groups: int, play_every: int) -> dict:
+    """تحديث صورة من إحدى المحادثات، أو أمر /play بدل كل `play_every`-ث تحديث من نفس المحادثة
+
+    يُحسب الدور لكل محادثة على حدة حتى تكون في الخزنة صور قبل كل /play.
+    """
+    chat = n % (chats + groups)
+    if chat < groups:
+        # مجموعات مزدحمة: مستخدمون مختلفون يرسلون إلى نفس المحادثة
+        chat_id, user_id, chat_type = -(chat + 1), 1000 + n % 50, "supergroup"
+    else:
+        chat_id = user_id = chat - groups + 1
+        chat_type = "private"
+    message = {
+        "message_id": n + 1, "date": int(time.time()),
+        "chat": {"id": chat_id, "type": chat_type},
+        "from": {"id": user_id, "is_bot": False, "first_name": "load"},
+    }
+    if play_every and chat_type == "private" and n // (chats + groups) % play_every == play_every - 1:
+        message.update(text="/play 3", entities=[{"type": "bot_command", "offset": 0, "length": 5}])
+    else:
+        message["photo"] = [{"file_id": f"photo-{n}", "file_unique_id": f"unique-{n}",
+                             "width": 90, "height": 90, "file_size": 1000}]
+    return {"update_id": n + 1, "message": message}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_bot(api_base: str, scheduler: bool):
+    """تشغيل البوت نفسه عبر main() مع توجيه طلباته إلى Bot API الوهمي"""
+    from aiogram.bot.api import TelegramAPIServer
+    import bot as vault
+
+    logging.getLogger().setLevel(logging.WARNING)
+    vault.bot.server = TelegramAPIServer.from_base(api_base)
+    if not scheduler:
+        # بدون عامل المجدول تُرسل الطلبات فورًا كما كان البوت يفعل سابقًا
+        async def start():
+            pass
+        vault.outbound.start = start
+    try:
+        asyncio.run(vault.main())
+    except KeyboardInterrupt:
+        pass
+
+
+async def run(args):
+    """قياس زمن الرد من وصول التحديث إلى البوت حتى وصول رده إلى Telegram"""
+    api = FakeTelegramAPI(args.rtt, args.slow_chats, args.slow_delay, args.limits)
+    base = await api.start()
+    port = free_port()
+    env = dict(os.environ, BOT_MODE=args.mode, DB_PATH=os.path.join(tempfile.mkdtemp(), "loadtest.db"),
+               WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBAPP_HOST="127.0.0.1", WEBAPP_PORT=str(port),
+               WEBHOOK_CONCURRENCY=str(args.concurrency), WEBHOOK_SECRET="loadtest", LOG_FILE="",
+               METRICS_PORT="0", METRICS_ENABLED="0" if args.no_metrics else "1")
+    # البوت في عملية مستقلة حتى لا يتقاسم حلقة الأحداث مع مولد الحمل
+    command = [sys.executable, __file__, "--bot", base] + (["--no-scheduler"] if args.no_scheduler else [])
+    cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+    process = await asyncio.create_subprocess_exec(*command, env=env)
+    await asyncio.wait_for(api.ready.wait(), 30)
+
+    session = ClientSession(connector=TCPConnector(limit=args.connections))
+    headers = {SECRET_HEADER: "loadtest"}
+
+    async def offer(update: dict):
+        if args.mode == "polling":
+            api.push(update)
+            return
+        async with session.post(api.webhook_url, json=update, headers=headers) as response:
+            response.raise_for_status()
+
+    posts = []
+    start = time.perf_counter()
+    for n in range(args.updates):
+        if args.rate:
+            delay = start + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = make_update(n, args.chats, args.groups, args.play_every)
+        message = update["message"]
+        pending = api.requested if "text" in message else api.offered
+        pending[message["chat"]["id"]].append(time.perf_counter())
+        api.expected += "photo" in message
+        posts.append(asyncio.create_task(offer(update)))
+    await asyncio.gather(*posts)
+    try:
+        await asyncio.wait_for(api.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        print(f"⚠️ وصل تأكيد {len(api.ack_latencies)} ملفًا فقط من {api.expected}")
+
+    # SIGTERM يختبر الإيقاف الآمن لخادم webhook، وpolling يُوقف بـ Ctrl+C
+    process.send_signal(signal.SIGTERM if args.mode == "webhook" else signal.SIGINT)
+    await process.wait()
+    await session.close()
+    await api.close()
+
+    elapsed = max(api.acked_at) - start
+    print(f"{args.mode}: {len(api.ack_latencies) / elapsed:.0f} تحديث/ث - "
+          f"{latency_summary(api.ack_latencies)}")
+    if args.play_every:
+        print(f"  /play: {latency_summary(api.delivery_latencies)}")
+    if cpu_before:
+        # زمن المعالج الذي استهلكته عملية البوت كاملة، بما فيه التشغيل والإيقاف
+        cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = cpu_after.ru_utime + cpu_after.ru_stime - cpu_before.ru_utime - cpu_before.ru_stime
+        print(f"  معالج البوت: {cpu:.2f} s ({cpu / args.updates * 1000:.2f} ms لكل تحديث)")
+    if args.limits:
+        print(f"  رسائل مقبولة: {api.messages} ({api.messages / elapsed:.1f}/ث) - ردود 429: {api.rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اختبار حمل لوضعي polling و webhook ضد Bot API وهمي")
+    parser.add_argument("--mode", choices=["polling", "webhook"])
+    parser.add_argument("--bot", metavar="API_BASE", help=argparse.SUPPRESS)
+    parser.add_argument("--updates", type=int, default=1500)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=0, help="مجموعات مزدحمة تستقبل جزءًا من التحديثات")
+    parser.add_argument("--play-every", type=int, default=0, help="إرسال /play 3 بدل كل N-ث صورة من المحادثة")
+    parser.add_argument("--rate", type=float, default=100, help="تحديث/ث، و0 للإرسال دفعة واحدة")
+    parser.add_argument("--rtt", type=float, default=0.05, help="زمن الذهاب والعودة إلى Telegram بالثواني")
+    parser.add_argument("--slow-chats", type=int, default=2, help="محادثات يتأخر الرد فيها لمحاكاة معالج بطيء")
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--limits", action="store_true", help="رفض الإرسال الزائد بـ 429 كما تفعل Telegram")
+    parser.add_argument("--no-scheduler", action="store_true", help="الإرسال فورًا دون مجدول الإرسال")
+    parser.add_argument("--no-metrics", action="store_true", help="تشغيل البوت مع METRICS_ENABLED=0")
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    if args.bot:
+        run_bot(args.bot, not args.no_scheduler)
+        return
+    if args.mode:
+        asyncio.run(run(args))
+        return
+    # كل وضع في عملية مستقلة حتى لا تتشارك حالة البوت
+    for mode in ("polling", "webhook"):
+        subprocess.run([sys.executable, __file__, "--mode", mode] + sys.argv[1:], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+# خصائص LogRecord القياسية، وما عداها حقول مُمررة عبر extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """تنسيق كل سجل كسطر JSON واحد مع الحقول الإضافية"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler يؤجل تنسيق الرسالة إلى خيط المستمع
+
+    QueueHandler الافتراضي ينسق الرسالة في الخيط المستدعي، أي داخل حلقة الأحداث،
+    فنُمرر السجل كما هو ويتولى QueueListener كل التنسيق والكتابة.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class StoppableQueueListener(QueueListener):
+    """QueueListener يمكن إيقافه أكثر من مرة، كما في Python 3.12"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(level: int = logging.INFO, path: Optional[str] = "bot.log", max_bytes: int = 10 * 1024 * 1024,
+                  backups: int = 5, console: bool = True) -> QueueListener:
+    """توجيه كل السجلات عبر طابور إلى خيط منفصل يكتبها إلى ملف JSON دوّار والطرفية"""
+    handlers = []
+    if path:
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = StoppableQueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # كتابة ما تبقى في الطابور عند الخروج
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,103 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+
+from aiogram import Bot, types
+from aiogram.types import Message
+
+# أقصى عدد عناصر يقبله sendMediaGroup في رسالة واحدة
+MEDIA_GROUP_LIMIT = 10
+
+
+class MediaKind(NamedTuple):
+    # يُرجع كائن الملف من الرسالة وبياناته الوصفية
+    extract: Callable[[Message], Tuple[Any, dict]]
+    send_method: str
+    # None يعني أن النوع لا يمكن إرساله ضمن ألبوم
+    input_media: Optional[Type[types.InputMedia]]
+    # الأنواع التي تشترك في نفس المفتاح يمكن جمعها في ألبوم واحد
+    album: Optional[str]
+
+
+MEDIA_KINDS: Dict[str, MediaKind] = {
+    types.ContentType.PHOTO: MediaKind(
+        extract=lambda message: (message.photo[-1], {"mime_type": "image/jpeg"}),
+        send_method="send_photo",
+        input_media=types.InputMediaPhoto,
+        album="visual",
+    ),
+    types.ContentType.VIDEO: MediaKind(
+        extract=lambda message: (message.video, {"mime_type": message.video.mime_type}),
+        send_method="send_video",
+        input_media=types.InputMediaVideo,
+        album="visual",
+    ),
+    types.ContentType.DOCUMENT: MediaKind(
+        extract=lambda message: (message.document, {
+            "file_name": message.document.file_name, "mime_type": message.document.mime_type,
+        }),
+        send_method="send_document",
+        input_media=types.InputMediaDocument,
+        album="document",
+    ),
+    types.ContentType.AUDIO: MediaKind(
+        extract=lambda message: (message.audio, {"mime_type": message.audio.mime_type}),
+        send_method="send_audio",
+        input_media=types.InputMediaAudio,
+        album="audio",
+    ),
+    types.ContentType.ANIMATION: MediaKind(
+        extract=lambda message: (message.animation, {"mime_type": "image/gif"}),
+        send_method="send_animation",
+        input_media=None,
+        album=None,
+    ),
+}
+
+MEDIA_CONTENT_TYPES = list(MEDIA_KINDS)
+
+
+async def send_media(bot: Bot, chat_id: int, file_type: str, file_id: str) -> bool:
+    """إرسال ملف واحد حسب نوعه، وإرجاع False إذا كان النوع غير مدعوم"""
+    kind = MEDIA_KINDS.get(file_type)
+    if kind is None:
+        return False
+    await getattr(bot, kind.send_method)(chat_id, file_id)
+    return True
+
+
+def plan_media_groups(files: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """تقسيم (file_id, file_type) إلى دفعات متوافقة لا تتجاوز MEDIA_GROUP_LIMIT
+
+    الملفات من نفس فئة الألبوم تُجمع معًا بترتيب ظهورها، وما لا يقبل الألبومات
+    يبقى دفعة من عنصر واحد.
+    """
+    albums: Dict[str, List[Tuple[str, str]]] = {}
+    batches: List[List[Tuple[str, str]]] = []
+    for file_id, file_type in files:
+        kind = MEDIA_KINDS.get(file_type)
+        if kind is None or kind.album is None:
+            batches.append([(file_id, file_type)])
+            continue
+        if kind.album not in albums:
+            albums[kind.album] = []
+            batches.append(albums[kind.album])
+        album = albums[kind.album]
+        if len(album) == MEDIA_GROUP_LIMIT:
+            album = albums[kind.album] = []
+            batches.append(album)
+        album.append((file_id, file_type))
+    return batches
+
+
+async def send_media_bulk(bot: Bot, chat_id: int, files: List[Tuple[str, str]]) -> int:
+    """إرسال عدة ملفات بأقل عدد من الطلبات، وإرجاع عدد الملفات غير المدعومة"""
+    skipped = 0
+    for batch in plan_media_groups(files):
+        if len(batch) == 1:
+            file_id, file_type = batch[0]
+            if not await send_media(bot, chat_id, file_type, file_id):
+                skipped += 1
+            continue
+        await bot.send_media_group(chat_id, [
+            MEDIA_KINDS[file_type].input_media(media=file_id) for file_id, file_type in batch
+        ])
+    return skipped
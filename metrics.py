@@ -0,0 +1,340 @@
+import functools
+import heapq
+import itertools
+import json
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import Dispatcher, types
+
+# حدود الهيستوغرام بالثواني، من نصف ملي ثانية حتى عشر ثوانٍ
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """توزيع القيم على حدود ثابتة بأسلوب Prometheus"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # خانة إضافية أخيرة لما يتجاوز أكبر حد (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """تقدير القيمة عند النسبة `q` بالاستيفاء الخطي داخل الخانة"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Family:
+    """مقياس واحد بكل تركيبات التسميات (labels) الخاصة به"""
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Tuple[str, ...], factory: Callable):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values) -> object:
+        # المسار السريع: التسميات نصوص في أغلب الاستدعاءات فلا داعي لتحويلها
+        child = self._children.get(values)
+        if child is None:
+            key = tuple(str(value) for value in values)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._factory()
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], object]]:
+        return list(self._children.items())
+
+
+class Registry:
+    """سجل المقاييس وتصديرها بصيغة Prometheus النصية"""
+
+    def __init__(self):
+        self.enabled = True
+        self._families: Dict[str, Family] = {}
+        # مقاييس تُقرأ من مصدرها عند التصدير فقط: name ← (help, kind, labelnames, callback)
+        self._collectors: Dict[str, Tuple[str, str, Tuple[str, ...], Callable[[], Dict[Tuple, float]]]] = {}
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Family:
+        return self._register(Family(name, help_text, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Family:
+        return self._register(Family(name, help_text, "counter", labelnames, Counter))
+
+    def collector(self, name: str, help_text: str, kind: str, labelnames: Tuple[str, ...],
+                  callback: Callable[[], Dict[Tuple, float]]):
+        """مقياس (counter أو gauge) تُحسب قيمه عند التصدير، مثل عدادات الذاكرة المؤقتة الموجودة أصلًا"""
+        self._collectors[name] = (help_text, kind, labelnames, callback)
+
+    def _register(self, family: Family) -> Family:
+        # إعادة تحميل الوحدة تُرجع نفس المقياس بدل تكراره
+        return self._families.setdefault(family.name, family)
+
+    def get(self, name: str) -> Optional[Family]:
+        return self._families.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children():
+                labels = _labels(family.labelnames, values)
+                if family.kind == "counter":
+                    lines.append(f"{family.name}_total{_braces(labels)} {child.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(child.bounds) + ["+Inf"], child.counts):
+                    cumulative += count
+                    bucket_labels = labels + [f'le="{bound}"']
+                    lines.append(f"{family.name}_bucket{_braces(bucket_labels)} {cumulative}")
+                lines.append(f"{family.name}_sum{_braces(labels)} {child.sum}")
+                lines.append(f"{family.name}_count{_braces(labels)} {child.count}")
+        for name, (help_text, kind, labelnames, callback) in self._collectors.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            suffix = "_total" if kind == "counter" else ""
+            for values, value in callback().items():
+                lines.append(f"{name}{suffix}{_braces(_labels(labelnames, values))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> List[str]:
+    return [f'{name}="{value}"' for name, value in zip(names, values)]
+
+
+def _braces(labels: List[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+REGISTRY = Registry()
+
+
+class UpdateTrace:
+    """تفصيل زمن تحديث واحد حسب نوع العملية، للتحديثات المختارة في العينة فقط"""
+
+    __slots__ = ("totals", "spans")
+
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.spans: List[Tuple[float, str]] = []
+
+    def add(self, kind: str, name: str, seconds: float):
+        self.totals[kind] += seconds
+        self.spans.append((seconds, f"{kind}:{name}"))
+
+
+_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("update_trace", default=None)
+# (اسم المعالج، هيستوغرام المعالج، هيستوغرام نوع التحديث، وقت بدء المعالج) لآخر معالج بدأ
+# في المهمة الحالية، يضبطه غلاف المعالج ويقرؤه process_update دون set/reset لكل تحديث
+_handler_start: ContextVar[Optional[tuple]] = ContextVar("handler_start", default=None)
+
+
+def record_span(kind: str, name: str, seconds: float):
+    """إضافة عملية إلى تفصيل التحديث الحالي إن كان ضمن العينة"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(kind, name, seconds)
+
+
+async def _observe(call: Awaitable, histogram: Histogram, failures: Counter, kind: str, name: str):
+    """انتظار `call` وتسجيل زمنه في `histogram` وفشله في `failures`"""
+    started = time.perf_counter()
+    try:
+        return await call
+    except Exception:
+        failures.inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed)
+        record_span(kind, name, elapsed)
+
+
+def timed(seconds: Family, errors: Family, kind: str):
+    """مزخرف يقيس زمن كل استدعاء لدالة غير متزامنة وعدد أخطائها، بتسمية اسم الدالة
+
+    الغلاف دالة عادية تُرجع coroutine الدالة نفسه عند تعطيل القياس، فلا يضيف إطارًا
+    يمر به كل استئناف بعد انتظار SQLite أو الشبكة.
+    """
+    def decorator(func):
+        name = func.__name__
+        histogram = seconds.labels(name)
+        failures = errors.labels(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(*args, **kwargs)
+            return _observe(func(*args, **kwargs), histogram, failures, kind, name)
+        return wrapper
+    return decorator
+
+
+class SlowUpdateProfiler:
+    """أخذ عينة من التحديثات وتفصيل أزمنتها، مع الاحتفاظ بأبطأ `keep` تحديثًا"""
+
+    def __init__(self, sample_rate: float = 0.0, keep: int = 20):
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._slowest: List[Tuple[float, int, dict]] = []
+        self._seq = itertools.count()
+        self._counter = 0
+
+    def start(self):
+        """بدء تتبع التحديث الحالي إذا وقع في العينة، ويُرجع رمزًا يُمرر إلى finish"""
+        if self.sample_rate <= 0:
+            return None
+        # عينة منتظمة بدل العشوائية: تحديث واحد كل 1/sample_rate
+        self._counter += 1
+        if self._counter * self.sample_rate < 1:
+            return None
+        self._counter = 0
+        return _trace.set(UpdateTrace())
+
+    def finish(self, token, seconds: float, **info):
+        if token is None:
+            return
+        trace = _trace.get()
+        _trace.reset(token)
+        if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+            return
+        spent = sum(trace.totals.values())
+        entry = dict(info, ms=round(seconds * 1000, 2),
+                     breakdown_ms={kind: round(value * 1000, 2) for kind, value in trace.totals.items()},
+                     other_ms=round(max(0.0, seconds - spent) * 1000, 2),
+                     top=[(name, round(value * 1000, 2)) for value, name in heapq.nlargest(5, trace.spans)])
+        item = (seconds, next(self._seq), entry)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heapreplace(self._slowest, item)
+
+    def slowest(self) -> List[dict]:
+        return [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+
+
+class MetricsDispatcher(Dispatcher):
+    """Dispatcher يقيس زمن كل تحديث وكل معالج
+
+    القياس داخل process_update، والمعالج يُغلَّف عند تسجيله بدالة عادية تسجل وقت بدئه
+    فقط، بدل middleware الذي يضيف أربعة استدعاءات غير متزامنة لكل تحديث أو غلاف
+    غير متزامن يمر به كل استئناف داخل المعالج. زمن المعالج يمتد من بدئه حتى نهاية
+    تحديثه، أي يشمل post_process في الـ middlewares.
+    """
+
+    def __init__(self, *args, profiler: Optional[SlowUpdateProfiler] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = profiler
+        self.update_seconds = REGISTRY.histogram("bot_update_seconds", "Total time to process an update", ("type",))
+        self.handler_seconds = REGISTRY.histogram("bot_handler_seconds",
+                                                  "Time from handler start to the end of its update", ("handler",))
+
+    async def process_update(self, update: types.Update):
+        if not REGISTRY.enabled:
+            return await super().process_update(update)
+        started = time.perf_counter()
+        token = self.profiler.start() if self.profiler else None
+        try:
+            return await super().process_update(update)
+        finally:
+            finished = time.perf_counter()
+            start = _handler_start.get()
+            # قيمة أقدم من بداية التحديث بقيت من تحديث سابق في نفس المهمة ولم يبدأ معالج لهذا
+            if start is not None and start[3] >= started:
+                name, handler_seconds, update_seconds, handler_started = start
+                handler_seconds.observe(finished - handler_started)
+            else:
+                name, update_seconds = None, self.update_seconds.labels(_update_type(update))
+            update_seconds.observe(finished - started)
+            if token is not None:
+                self.profiler.finish(token, finished - started, update_id=update.update_id,
+                                     type=_update_type(update), handler=name)
+
+    def register_message_handler(self, callback, *args, **kwargs):
+        super().register_message_handler(self._timed_handler(callback, "message"), *args, **kwargs)
+
+    def register_callback_query_handler(self, callback, *args, **kwargs):
+        super().register_callback_query_handler(self._timed_handler(callback, "callback_query"), *args, **kwargs)
+
+    def _timed_handler(self, callback, update_type: str):
+        name = callback.__name__
+        # الهيستوغرامات محددة مسبقًا حتى لا يبحث التحديث عن نوعه وتسمياته في كل مرة
+        start = (name, self.handler_seconds.labels(name), self.update_seconds.labels(update_type))
+
+        # functools.wraps تحفظ __wrapped__ فيقرأ aiogram وسائط المعالج الأصلي كما هي
+        @functools.wraps(callback)
+        def handler(*args, **kwargs):
+            if REGISTRY.enabled:
+                _handler_start.set(start + (time.perf_counter(),))
+            return callback(*args, **kwargs)
+        return handler
+
+
+def _update_type(update: types.Update) -> str:
+    # update.values يحوي الحقول الموجودة فقط، وهو أسرع من المرور على خصائص Update
+    for field in update.values:
+        if field != "update_id":
+            return field
+    return "other"
+
+
+async def start_metrics_server(host: str, port: int, profiler: Optional[SlowUpdateProfiler] = None) -> web.AppRunner:
+    """خادم HTTP محلي يعرض /metrics بصيغة Prometheus و /debug/slow لأبطأ التحديثات"""
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def slow(request: web.Request) -> web.Response:
+        return web.json_response(profiler.slowest() if profiler else [],
+                                 dumps=functools.partial(json.dumps, ensure_ascii=False))
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/debug/slow", slow)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        # المنفذ مستخدم: لا يعود runner إلى المستدعي، فيُنظَّف هنا
+        await runner.cleanup()
+        raise
+    return runner
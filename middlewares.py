@@ -1,22 +1,41 @@
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import Message
 import logging
+import random
+
+# أقصى عدد أحرف من نص الرسالة يُحفظ في السجل
+TEXT_PREVIEW_LENGTH = 64
 
 
 class LoggingMiddleware(BaseMiddleware):
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, level: int = logging.INFO, sample_rate: float = 1.0):
         super().__init__()
         self.logger = logger
+        self.level = level
+        # نسبة الرسائل التي تُسجل، لتخفيف السجلات في المجموعات المزدحمة
+        self.sample_rate = sample_rate
 
     async def on_process_message(self, message: Message, data: dict):
         """تسجيل كل رسالة يتم استقبالها"""
+        # الخروج قبل بناء أي شيء إذا كان السجل لن يُكتب أصلًا
+        if not self.logger.isEnabledFor(self.level):
+            return
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
         try:
-            user_id = message.from_user.id
-            username = message.from_user.username or "غير معروف"
-            content_type = message.content_type
-            text = message.text or message.caption or "📎 [محتوى غير نصي]"
-
-            self.logger.info(f"📩 رسالة جديدة من {user_id} (@{username}) - النوع: {content_type} - المحتوى: {text}")
+            user = message.from_user
+            text = message.text or message.caption
+            # التنسيق يتم لاحقًا في خيط الكتابة، والحقول تُحفظ منفصلة في سطر JSON
+            self.logger.log(
+                self.level, "📩 رسالة جديدة من %s (@%s) - النوع: %s",
+                user.id if user else None, (user.username if user else None) or "غير معروف", message.content_type,
+                extra={
+                    "chat_id": message.chat.id,
+                    "user_id": user.id if user else None,
+                    "content_type": message.content_type,
+                    "text": text[:TEXT_PREVIEW_LENGTH] if text else None,
+                },
+            )
 
         except Exception as e:
-            self.logger.error(f"⚠️ خطأ أثناء تسجيل الرسالة: {e}")
+            self.logger.error("⚠️ خطأ أثناء تسجيل الرسالة: %s", e)
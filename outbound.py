@@ -0,0 +1,284 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import Message
+from aiogram.utils.exceptions import RetryAfter
+
+from cache import LRUCache
+from metrics import REGISTRY, record_span
+
+logger = logging.getLogger(__name__)
+
+# الأولوية الأصغر تُرسل أولًا: الملفات التي طلبها المستخدم قبل الردود، والردود قبل تأكيدات الحفظ
+DELIVERY, REPLY, ACK = 0, 1, 2
+
+# الطلبات التي تحسبها Telegram ضمن حدود الرسائل، وما عداها يُرسل مباشرة
+LIMITED_METHODS = ("send", "forward", "copy", "edit")
+
+API_SECONDS = REGISTRY.histogram("telegram_api_seconds", "Duration of Telegram Bot API requests", ("method",))
+API_ERRORS = REGISTRY.counter("telegram_api_errors", "Failed Telegram Bot API requests", ("method",))
+WAIT_SECONDS = REGISTRY.histogram("outbound_wait_seconds", "Time sends waited for the rate limiter", ("priority",))
+PRIORITY_NAMES = ("delivery", "reply", "ack")
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=REPLY)
+# الطلب الحالي حصل على إذن الإرسال مسبقًا ولا يحتاج انتظار دوره مرة أخرى
+_granted: ContextVar[bool] = ContextVar("outbound_granted", default=False)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """تحديد أولوية طلبات الإرسال داخل هذا السياق"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """دلو رموز: `rate` رمزًا في الثانية وحتى `capacity` رموز متراكمة"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, cost: float = 1) -> float:
+        """عدد الثواني المتبقية حتى يتوفر `cost` رموز"""
+        self._refill(now)
+        # إرسال أكبر من السعة يُسمح به عند امتلاء الدلو ويُسدد من الرصيد لاحقًا
+        missing = min(cost, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0
+
+    def take(self, now: float, cost: float = 1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def penalize(self, now: float, seconds: float):
+        """منع الإرسال لمدة `seconds` بعد رد RetryAfter"""
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class OutboundScheduler:
+    """توزيع طلبات الإرسال على حدود Telegram العامة ولكل محادثة
+
+    كل طلب ينتظر رمزًا من الدلو العام ومن دلو محادثته، وعند تزاحم الطلبات
+    يُمنح الإذن للأعلى أولوية ثم للأقدم. تأكيدات الحفظ لنفس المحادثة تُدمج
+    في رد واحد إذا تراكمت قبل أن يحين دورها.
+    """
+
+    def __init__(self, global_rate: float = 20, global_burst: float = 10, chat_rate: float = 1,
+                 chat_burst: float = 1, group_rate: float = 19 / 60, group_burst: float = 1, max_retries: int = 3):
+        self.chat_limits = (chat_rate, chat_burst)
+        self.group_limits = (group_rate, group_burst)
+        self.max_retries = max_retries
+        # السعة 10 تتسع لألبوم كامل، و10 + 20 في الثانية لا تتجاوز 30 رسالة في أي ثانية
+        self._global = TokenBucket(global_rate, global_burst)
+        # الدلو المحذوف من الذاكرة يعود ممتلئًا، وهذا صحيح لمحادثة لم ترسل لها منذ مدة
+        self._buckets = LRUCache(maxsize=10000)
+        # chat_id ← كومة (priority, seq, cost, future) للطلبات المنتظرة
+        self._waiting: Dict[Optional[int], List[Tuple[int, int, float, asyncio.Future]]] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        # chat_id ← [عدد المحفوظ، عدد المكرر، الرسالة التي يُرد عليها]
+        self._acks: Dict[int, list] = {}
+        self._ack_tasks = set()
+        self.sent = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """إرسال التأكيدات المتبقية ثم إيقاف المجدول"""
+        if self._ack_tasks:
+            await asyncio.gather(*self._ack_tasks, return_exceptions=True)
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def _bucket(self, chat_id: Optional[int]) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate, burst = self.group_limits if chat_id < 0 else self.chat_limits
+            bucket = TokenBucket(rate, burst)
+            self._buckets.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: Optional[int], level: int = REPLY, cost: float = 1):
+        """الانتظار حتى يُسمح بإرسال طلب إلى `chat_id`"""
+        if self._worker is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting.setdefault(chat_id, []), (level, next(self._seq), cost, future))
+        self._wakeup.set()
+        await future
+
+    def retry_after(self, chat_id: Optional[int], seconds: float):
+        """إيقاف الإرسال إلى المحادثة (أو للجميع إن لم تُعرف) حتى انقضاء مهلة Telegram"""
+        self.retries += 1
+        bucket = self._bucket(chat_id) or self._global
+        bucket.penalize(time.monotonic(), seconds)
+
+    def acknowledge(self, message: Message, is_new: bool):
+        """رد تأكيد الحفظ دون انتظار، مع دمج التأكيدات المتراكمة لنفس المحادثة"""
+        chat_id = message.chat.id
+        pending = self._acks.get(chat_id)
+        if pending is None:
+            pending = self._acks[chat_id] = [0, 0, message]
+            task = asyncio.create_task(self._send_ack(chat_id))
+            self._ack_tasks.add(task)
+            task.add_done_callback(self._ack_tasks.discard)
+        else:
+            self.coalesced += 1
+        pending[0 if is_new else 1] += 1
+
+    async def _send_ack(self, chat_id: int):
+        await self.acquire(chat_id, ACK)
+        saved, duplicates, message = self._acks.pop(chat_id)
+        if saved + duplicates == 1:
+            text = "✅ **تم حفظ الملف بنجاح!**" if saved else "ℹ️ **هذا الملف محفوظ لديك مسبقًا!**"
+        else:
+            lines = []
+            if saved:
+                lines.append(f"✅ **تم حفظ {saved} ملفات بنجاح!**")
+            if duplicates:
+                lines.append(f"ℹ️ **{duplicates} ملفات محفوظة لديك مسبقًا!**")
+            text = "\n".join(lines)
+        token = _granted.set(True)
+        try:
+            await message.reply(text)
+        except Exception as e:
+            logger.error(f"⚠️ تعذر إرسال تأكيد الحفظ إلى {chat_id}: {e}")
+        finally:
+            _granted.reset(token)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            best = None
+            wait = None
+            for chat_id, heap in self._waiting.items():
+                level, seq, cost, _ = heap[0]
+                bucket = self._bucket(chat_id)
+                delay = bucket.delay(now, cost) if bucket else 0
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                elif best is None or (level, seq) < best[:2]:
+                    best = (level, seq, chat_id)
+            if best is not None:
+                level, seq, chat_id = best
+                cost = self._waiting[chat_id][0][2]
+                delay = self._global.delay(now, cost)
+                if delay <= 0:
+                    heap = self._waiting[chat_id]
+                    _, _, _, future = heapq.heappop(heap)
+                    if not heap:
+                        del self._waiting[chat_id]
+                    if future.cancelled():
+                        continue
+                    self._global.take(now, cost)
+                    bucket = self._bucket(chat_id)
+                    if bucket:
+                        bucket.take(now, cost)
+                    self.sent += 1
+                    future.set_result(None)
+                    continue
+                wait = delay if wait is None else min(wait, delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retries": self.retries, "coalesced": self.coalesced,
+                "waiting": sum(len(heap) for heap in self._waiting.values())}
+
+
+def _observe_api(method: str, started: float, failed: bool = False):
+    if not REGISTRY.enabled:
+        return
+    elapsed = time.perf_counter() - started
+    API_SECONDS.labels(method).observe(elapsed)
+    if failed:
+        API_ERRORS.labels(method).inc()
+    record_span("api", method, elapsed)
+
+
+class ScheduledBot(Bot):
+    """Bot يمرر كل طلبات الإرسال عبر OutboundScheduler ويعيد المحاولة بعد RetryAfter"""
+
+    def __init__(self, *args, scheduler: OutboundScheduler, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        # زمن الطلب يُقاس هنا مباشرة لا في coroutine غلاف، حتى لا يمر كل استئناف أثناء
+        # انتظار الشبكة بإطار إضافي
+        if not method.startswith(LIMITED_METHODS):
+            started = time.perf_counter()
+            try:
+                response = await super().request(method, data, files, **kwargs)
+            except Exception:
+                _observe_api(method, started, failed=True)
+                raise
+            _observe_api(method, started)
+            return response
+        chat_id = data.get("chat_id") if data else None
+        if isinstance(chat_id, str):
+            chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else None
+        # كل عنصر في الألبوم يُحسب رسالة مستقلة
+        cost = len(json.loads(data["media"])) if method == "sendMediaGroup" else 1
+        granted = _granted.get()
+        level = _priority.get()
+        for attempt in range(self.scheduler.max_retries + 1):
+            if not granted:
+                started = time.perf_counter()
+                await self.scheduler.acquire(chat_id, level, cost)
+                if REGISTRY.enabled:
+                    elapsed = time.perf_counter() - started
+                    WAIT_SECONDS.labels(PRIORITY_NAMES[level]).observe(elapsed)
+                    record_span("wait", method, elapsed)
+            granted = False
+            started = time.perf_counter()
+            try:
+                response = await super().request(method, data, files, **kwargs)
+            except RetryAfter as e:
+                _observe_api(method, started, failed=True)
+                if attempt == self.scheduler.max_retries:
+                    raise
+                logger.warning(f"⏳ Telegram طلب الانتظار {e.timeout} ثانية قبل {method} إلى {chat_id}")
+                self.scheduler.retry_after(chat_id, e.timeout)
+                continue
+            except Exception:
+                _observe_api(method, started, failed=True)
+                raise
+            _observe_api(method, started)
+            return response
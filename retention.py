@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from database import AsyncMediaStorage, DatabaseError, age_threshold
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+PurgeHook = Callable[[int, str, List[int]], None]
+
+
+class RetentionEngine:
+    """حذف الملفات القديمة على دفعات صغيرة حتى لا يُحجز قفل الكتابة طويلًا"""
+
+    def __init__(self, storage: AsyncMediaStorage, batch_size: int = 500, pause: float = 0.005,
+                 interval: float = 3600, vacuum_pages: int = 500, on_purge: Optional[PurgeHook] = None):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        # يُستدعى بعد كل دفعة محذوفة (user_id, threshold, ids) لإبطال الذاكرة المؤقتة
+        self.on_purge = on_purge
+        self._scheduler: Optional[asyncio.Task] = None
+
+    async def purge(self, user_id: int, threshold: str, progress: Optional[ProgressCallback] = None) -> int:
+        """حذف ملفات المستخدم الأقدم من `threshold` دفعةً بعد دفعة، وإرجاع عدد المحذوف"""
+        total = 0
+        while True:
+            deleted = await self.storage.adelete_batch(user_id, threshold, self.batch_size)
+            if not deleted:
+                break
+            total += len(deleted)
+            if self.on_purge:
+                self.on_purge(user_id, threshold, deleted)
+            if progress:
+                await progress(total)
+            if len(deleted) < self.batch_size:
+                break
+            # إفساح المجال لعمليات الحفظ المنتظرة على قفل الكتابة بين الدفعات
+            await asyncio.sleep(self.pause)
+        if total:
+            await self.vacuum()
+        return total
+
+    async def vacuum(self):
+        """تقليص ملف قاعدة البيانات تدريجيًا بعد الحذف"""
+        while await self.storage.aincremental_vacuum(self.vacuum_pages) > 0:
+            await asyncio.sleep(self.pause)
+
+    async def run_policies(self) -> int:
+        """تطبيق سياسات الاحتفاظ لكل المستخدمين مرة واحدة"""
+        total = 0
+        for user_id, ttl_days in await self.storage.alist_retention_policies():
+            deleted = await self.purge(user_id, age_threshold(ttl_days))
+            if deleted:
+                logger.info(f"🗑️ سياسة الاحتفاظ: حُذف {deleted} ملفًا للمستخدم {user_id}")
+            total += deleted
+        return total
+
+    async def start(self):
+        """تشغيل تطبيق سياسات الاحتفاظ دوريًا في الخلفية"""
+        if self._scheduler is None:
+            self._scheduler = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._scheduler is None:
+            return
+        self._scheduler.cancel()
+        try:
+            await self._scheduler
+        except asyncio.CancelledError:
+            pass
+        self._scheduler = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_policies()
+            except DatabaseError as e:
+                logger.error(f"🚨 خطأ أثناء تطبيق سياسات الاحتفاظ: {e}")
+            await asyncio.sleep(self.interval)
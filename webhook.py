@@ -0,0 +1,168 @@
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+DECODE_SECONDS = REGISTRY.histogram("webhook_decode_seconds", "Time to parse webhook JSON into an Update").labels()
+
+
+def update_chat_key(update: types.Update) -> Optional[Hashable]:
+    """مفتاح المحادثة الذي يجب أن تُعالج تحديثاته بالترتيب، أو None إن لم يوجد"""
+    for event in (update.message, update.edited_message, update.channel_post, update.edited_channel_post,
+                  update.my_chat_member, update.chat_member, update.chat_join_request):
+        if event:
+            return event.chat.id
+    if update.callback_query:
+        query = update.callback_query
+        return query.message.chat.id if query.message else query.from_user.id
+    for event in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query, update.poll_answer):
+        if event:
+            return event.from_user.id if hasattr(event, "from_user") else event.user.id
+    return None
+
+
+class WebhookServer:
+    """استقبال التحديثات عبر webhook ومعالجتها بتوازٍ محدود
+
+    تحديثات المحادثة الواحدة تُعالج بالترتيب واحدًا تلو الآخر، بينما تعمل
+    المحادثات المختلفة بالتوازي حتى `concurrency` تحديثًا في نفس الوقت، فلا
+    يؤخر معالج بطيء في محادثة بقية المحادثات.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, path: str = "/webhook", concurrency: int = 128,
+                 secret_token: Optional[str] = None, max_pending: int = 10000, drain_timeout: float = 30):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.drain_timeout = drain_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chats: Dict[Hashable, Deque[types.Update]] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self._pending = 0
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # مقارنة بزمن ثابت حتى لا يكشف زمن الرد عدد الأحرف الصحيحة من السر
+        if self.secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(),
+                                                         self.secret_token.encode()):
+            return web.Response(status=401)
+        # رد غير ناجح يجعل Telegram يعيد إرسال التحديث لاحقًا بدل فقدانه
+        if self._closing or self._pending >= self.max_pending:
+            return web.Response(status=503)
+        started = time.perf_counter()
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            # TypeError عندما يكون الجسم JSON صالحًا لكنه ليس كائنًا، مثل قائمة أو رقم
+            return web.Response(status=400)
+        if REGISTRY.enabled:
+            DECODE_SECONDS.observe(time.perf_counter() - started)
+        self.dispatch(update)
+        return web.Response()
+
+    def dispatch(self, update: types.Update):
+        """جدولة تحديث للمعالجة دون انتظار انتهائها"""
+        self._pending += 1
+        key = update_chat_key(update)
+        if key is None:
+            self._spawn(self._process(update))
+            return
+        queue = self._chats.get(key)
+        if queue is not None:
+            # عامل هذه المحادثة يعمل حاليًا وسيأخذ التحديث بعد الذي قبله
+            queue.append(update)
+            return
+        self._chats[key] = deque([update])
+        self._spawn(self._process_chat(key))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    async def _process_chat(self, key: Hashable):
+        queue = self._chats[key]
+        try:
+            while queue:
+                await self._process(queue[0])
+                queue.popleft()
+        finally:
+            del self._chats[key]
+
+    async def _process(self, update: types.Update):
+        async with self._semaphore:
+            try:
+                Bot.set_current(self.dispatcher.bot)
+                Dispatcher.set_current(self.dispatcher)
+                # عبر updates_handler حتى تعمل middlewares على مستوى التحديث كما في polling
+                await self.dispatcher.updates_handler.notify(update)
+            except Exception as e:
+                logger.exception(f"🚨 خطأ أثناء معالجة التحديث {update.update_id}: {e}")
+            finally:
+                self._pending -= 1
+
+    async def drain(self):
+        """رفض التحديثات الجديدة وانتظار إنهاء ما هو قيد المعالجة"""
+        self._closing = True
+        if not self._workers:
+            return
+        logger.info(f"⏳ انتظار إنهاء {self._pending} تحديثات قبل الإيقاف...")
+        _, unfinished = await asyncio.wait(set(self._workers), timeout=self.drain_timeout)
+        if unfinished:
+            logger.warning(f"⚠️ انتهت مهلة الإيقاف وبقي {self._pending} تحديثات دون معالجة")
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    async def start(self, host: str, port: int):
+        """بدء الاستماع لطلبات Telegram"""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        self._site = web.TCPSite(self._runner, host, port)
+        await self._site.start()
+        logger.info(f"🌐 خادم webhook يعمل على {host}:{port}{self.path}")
+
+    async def stop(self):
+        """إيقاف الاستماع ثم انتظار التحديثات الجارية قبل إغلاق الخادم"""
+        self._closing = True
+        await self._site.stop()
+        await self.drain()
+        await self._runner.cleanup()
+
+    async def wait_closed(self):
+        """الانتظار حتى الإلغاء أو استلام SIGTERM"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, AttributeError):
+            # Windows لا يدعم معالجات الإشارات في حلقة الأحداث، فيبقى الإيقاف عبر Ctrl+C فقط
+            await stop.wait()
+            return
+        try:
+            await stop.wait()
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)